@@ -2,74 +2,98 @@
 This file implements a variant of Q-learning for training the neural network
 """
 import threading
+import multiprocessing
+import os
 import random
 import time
 from MLP import MLP
+from sharedweights import SharedWeights
+from replay import ReplayMemory
+from replay import PrioritizedReplayMemory
+from qtable import QTable
 import pickle as pickle
 import numpy as np
 
 #This class provides access to the neural network, and runs a separate thread for training the network
 class Brain(threading.Thread):
-    def __init__(self, size, alpha, discount, seed):
+    def __init__(self, size, alpha, discount, seed, replayCapacity=100000, replayBatch=50, prioritized=False, trainBatch=None, trainBudget=None, validationFraction=None, patience=5, trainProcess=False):
         random.seed(seed)
         threading.Thread.__init__(self)
         
         self.time = time.time()
 
         self.quit = False
-        self.expectedRewards = {}
-        self.targets = {}
-        self.experiences = []
         self.error = []
 
+        #states are stored as compact keys, see packState
+        self.size = size
+        self.markerSlots = 2
+        self.occupancyBytes = (size*size + 7)//8
+
+        #recent experiences, replayBatch of which are replayed each time an action is chosen
+        #prioritized replay favours the experiences whose last update was largest, so rewards spread backwards in fewer updates
+        if prioritized:
+            self.replay = PrioritizedReplayMemory(replayCapacity, seed)
+        else:
+            self.replay = ReplayMemory(replayCapacity, seed)
+        self.replayBatch = replayBatch
+
+        #how the network is trained each second, by default every state is trained on at once for 100 epochs
+        #trainBatch splits the states into batches of that size, trainBudget limits the seconds spent training
+        #validationFraction holds out that portion of the states, training stops once their error has not improved for patience epochs
+        self.trainBatch = trainBatch
+        self.trainBudget = trainBudget
+        self.validationFraction = validationFraction
+        self.patience = patience
+
         #If there is previous training data available load it
+        keys, values, targets = [], [], []
         try:
-            with open("observations/rewards.dat", 'rb') as inFile:
-                self.expectedRewards = pickle.load(inFile)
-
-            with open("observations/targets.dat", 'rb') as inFile:
-                self.targets = pickle.load(inFile)
-            with open("observations/states.dat", 'rb') as inFile:
-                self.states = pickle.load(inFile)
-                
+            with open("observations/table.dat", 'rb') as inFile:
+                keys, values, targets = pickle.load(inFile)
         except:
-            print("rewards targets or states not loaded")
-            self.expectedRewards = {}
-            self.targets = {}
-            self.states = []
+            #tables saved before this format are dictionaries from state to expected rewards, keyed by tuples of cells if saved before states were packed
+            try:
+                with open("observations/rewards.dat", 'rb') as inFile:
+                    rewards = pickle.load(inFile)
+                with open("observations/targets.dat", 'rb') as inFile:
+                    oldTargets = pickle.load(inFile)
+                keys = [(key if isinstance(key, bytes) else self.packState(key)) for key in rewards]
+                values = list(rewards.values())
+                targets = [oldTargets[key] for key in rewards]
+            except:
+                print("state table not loaded")
 
      
         self.alpha = alpha
         self.discount = discount
         self.oldScore = 0
         self.oldAction = 0
-        self.oldState = [0,]*(100)
-        self.oldState = tuple(self.oldState)
+        self.oldState = self.packState(np.zeros(size*size))
+
+        #every state in the table is given a dense id, so experiences can refer to states by id, and the table can be checked for a state in constant time
+        #the expected rewards, targets, and network input of each state are rows of the table, indexed by id
+        #trainProcess trains the network in another process, which reads the targets and inputs of the table from shared memory and publishes each new set of weights through sharedWeights
+        structure = [(size*size), 25, 5]
+        self.sharedWeights = None
+        self.worker = None
+        if trainProcess:
+            self.sharedWeights = SharedWeights([(structure[x] + 1, structure[x + 1]) for x in range(len(structure) - 1)])
+            self.table = QTable(5, size*size, shared=True, moved=self.sharedWeights.setTable)
+        else:
+            self.table = QTable(5, size*size)
+        self.stateIds = {}
+        self.stateKeys = []
+        if len(keys) > 0:
+            self.table.add(values, self.unpackStates(keys), targets)
+            self.stateKeys = list(keys)
+            self.stateIds = {key: stateId for stateId, key in enumerate(keys)}
 
         #If no previous data was loaded, store an initial state
-        if self.oldState not in self.expectedRewards:
-            newTarget = [random.random(),]*5
-            self.expectedRewards[self.oldState] = newTarget
-            
-            #Normalize the rewards so they can be used as targets for the network
-            bestReward = float('-inf')
-            worstReward = float('inf')
-            for x in newTarget:
-                if x < worstReward:
-                    worstReward = x
-                if x > bestReward:
-                    bestReward = x
-
-            if bestReward - worstReward == 0:
-                pass
-            else:
-                for x in range(len()):
-                    newTarget[x] = (newTarget[x] - worstReward)/(bestReward - worstReward)
-
-            self.targets[self.oldState] = newTarget
+        self.addState(self.oldState)
 
         #initialize the neural network
-        self.NN = MLP([(size*size), 25, 5], seed)
+        self.NN = MLP(structure, seed)
 
         #If a previously trained weight matrix exists load it
         name = ""
@@ -82,6 +106,9 @@ class Brain(threading.Thread):
             print("matrix not found")
             pass
 
+        if self.sharedWeights is not None:
+            self.NN.share(self.sharedWeights)
+
     #This method is used to update the set of previously observed sates, and expected rewards for each action
     def updateTable(self, score, state, action):
         #the reward for the pervious state and action
@@ -105,22 +132,14 @@ class Brain(threading.Thread):
             rndAction[rndChoice] = 1
             return rndAction
 
-        #convert the passed state to the form required by the neural network
-        longState = []
-        for x in state:
-            for y in x:
-                longState.append(y)
-
-        #discretize the state
-        for x in range(len(longState)):
-            if longState[x] > 0.5 and longState[x] <= 1:
-                longState[x] = 1
-            elif longState[x] <= 0.5 and longState[x] >= 0:
-                longState[x] = 0
+        #convert the passed state to the form required by the neural network, and discretize it
+        #cells outside [0, 1] are markers, such as the robot and its heading, and are left as they are
+        cells = np.asarray(state, dtype=np.float64).ravel()
+        cells = np.where((cells >= 0) & (cells <= 1), (cells > 0.5).astype(np.float64), cells)
        
         #get an action from the neural network
-        longState = tuple(longState)
-        result = self.NN.getAction(longState)
+        longState = self.packState(cells)
+        result = self.NN.getAction(cells)
         
         bestScore = float('-inf')
         act = 0
@@ -132,111 +151,129 @@ class Brain(threading.Thread):
         action = [0,]*5
         action[act] = 1
 
-        stateID = longState
-
-        self.experiences.append((self.oldState, act, score - self.oldScore, longState))
-        if len(self.experiences) > 100:
-            del self.experiences[0]
+        self.addState(longState, cells)
+        self.replay.add(self.stateIds[self.oldState], act, score - self.oldScore, self.stateIds[longState])
 
-        #This loop replays recent experiences to update the state/action/reward table
+        #This replays recent experiences to update the state/action/reward table
         #over time it helps to propagate future rewards backwards more quickly
         #this is needed since the updateTable method only propagates a future reward backwards one state
         #This means that for the table to properly reflect long term gains the system must experience some state, and take the same action many times
         #The constraints of real time learning make this infeasible
-        for x in range(int(len(self.experiences)*0.5)):
-            rndExperience = int(random.random()*len(self.experiences))
-            experience = self.experiences[rndExperience]
-            state = experience[0]
-            nextState = experience[3]
-            observedReward = experience[2]
-            self.updateTableEntry(observedReward, state, experience[1], nextState)
-            
+        replays = min(self.replayBatch, len(self.replay)//2)
+        if replays > 0:
+            positions, batch, weights = self.replay.sample(replays)
+            errors = self.updateTableBatch(batch, weights)
+            self.replay.update(positions, errors)
                 
         #update the state table and return the result to the arbitrator
         self.updateTable(score, longState, act)
-
-        
-
-        if longState not in self.states:
-            self.states.append(longState)
         
         print(result)
 
         return action
 
-    #This method is used to update entries in the state action reward table
-    def updateTableEntry(self, observedReward, state, action, nextState):
-
-        #If a new state is passed compute random expected rewards
-        if nextState not in self.expectedRewards:
+    #This method packs a discretized state into a key, one bit for each occupied cell followed by the index and value of each marker cell
+    #marker slots which are not used have the index 0xFFFF, so every key has the same length
+    #the key takes around a sixteenth of the memory of a tuple of the cells, and is cheap to hash and pickle
+    def packState(self, cells):
+        cells = np.asarray(cells, dtype=np.float64).ravel()
+        markers = np.flatnonzero((cells < 0) | (cells > 1))
+        if len(markers) > self.markerSlots:
+            raise ValueError("a state may have at most " + str(self.markerSlots) + " marker cells")
+
+        indices = np.full(self.markerSlots, 0xFFFF, dtype='<u2')
+        values = np.zeros(self.markerSlots, dtype=np.uint8)
+        indices[:len(markers)] = markers
+        values[:len(markers)] = cells[markers]
+        return np.packbits(cells == 1).tobytes() + indices.tobytes() + values.tobytes()
+
+    #This method unpacks many keys at once, see packState
+    #returns an array with a row of cells for each key
+    def unpackStates(self, keys):
+        cellCount = self.size*self.size
+        data = np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(len(keys), -1)
+        cells = np.unpackbits(data[:, :self.occupancyBytes], axis=1)[:, :cellCount].astype(np.float64)
+
+        markerStart = self.occupancyBytes + 2*self.markerSlots
+        indices = data[:, self.occupancyBytes:markerStart].copy().view('<u2')
+        values = data[:, markerStart:]
+        rows, slots = np.nonzero(indices != 0xFFFF)
+        cells[rows, indices[rows, slots]] = values[rows, slots]
+        return cells
+
+    #This method adds a state to the table with random expected rewards, if it is not already present
+    #returns the id of the state
+    def addState(self, state, cells=None):
+        if state not in self.stateIds:
+            if cells is None:
+                cells = self.unpackStates([state])
+
+            #every action has the same expected reward, so there is nothing to normalize and the rewards are used as targets
             initialReward = [random.random(),]*5
-            self.expectedRewards[nextState] = initialReward
-            newTarget = [0,]*5
-          
-            bestReward = float('-inf')
-            worstReward = float('inf')
-            for x in initialReward:
-                if x < worstReward:
-                    worstReward = x
-                if x > bestReward:
-                    bestReward = x
-
-            if bestReward - worstReward == 0:
-                newTarget = initialReward
-            else:
-                for x in range(len(initialReward)):
-                    newTarget[x] = (newTarget[x] - worstReward)/(bestReward - worstReward)
+            self.table.add(initialReward, cells, initialReward)
+            self.stateIds[state] = len(self.stateKeys)
+            self.stateKeys.append(state)
 
-            self.targets[nextState] = newTarget
+        return self.stateIds[state]
 
-        #update the expected reward for the appropriate task
-        expectedReward = self.expectedRewards[state][action]
-        futureReward = float('-inf')
-        for y in self.expectedRewards[nextState]:
-            if y > futureReward:
-                futureReward = y
-        self.expectedRewards[state][action] = expectedReward + self.alpha*(observedReward + (self.discount*futureReward) - expectedReward)
-
-        rewards = self.expectedRewards[state]
-
-        newTarget = [0,]*5
-        bestReward = float('-inf')
-        worstReward = float('inf')
-        for x in rewards:
-            if x < worstReward:
-                worstReward = x
-            if x > bestReward:
-                bestReward = x
-        if bestReward - worstReward == 0:
-            pass
-        else:
-            for x in range(len(rewards)):
-                newTarget[x] = (rewards[x] - worstReward)/(bestReward - worstReward)
-        
-        self.targets[state] = newTarget
+    #This method is used to update entries in the state action reward table
+    def updateTableEntry(self, observedReward, state, action, nextState):
+        stateId = self.addState(state)
+        nextStateId = self.addState(nextState)
 
+        #update the expected reward for the appropriate task
+        rewards = self.table.values[[stateId]]
+        expectedReward = rewards[0, action]
+        futureReward = self.table.values[nextStateId].max()
+        rewards[0, action] = expectedReward + self.alpha*(observedReward + (self.discount*futureReward) - expectedReward)
+
+        self.table.update([stateId], rewards)
+
+    #This method applies the updates of a batch of experiences at once, see updateTableEntry
+    #every update is computed from the table as it was before the batch, and each update's error is scaled by its weight
+    #k updates of the same state and action move it by 1 - (1 - alpha)^k of their mean error, which is what k updates in turn would do if they shared a target
+    #returns the error of each update before it was weighted
+    def updateTableBatch(self, batch, weights):
+        states, rows = np.unique(batch['state'], return_inverse=True)
+        rows = rows.reshape(-1)
+        actions = batch['action'].astype(np.intp)
+        rewards = self.table.values[states]
+        futureRewards = self.table.values[batch['nextState']].max(axis=1)
+
+        errors = batch['reward'] + self.discount*futureRewards - rewards[rows, actions]
+        cells, inverse, counts = np.unique(rows*5 + actions, return_inverse=True, return_counts=True)
+        meanErrors = np.bincount(inverse.reshape(-1), weights=errors*weights)/counts
+        rewards.flat[cells] += (1 - (1 - self.alpha)**counts)*meanErrors
+
+        self.table.update(states, rewards)
+        return errors
 
     #This method executes in a separtate thread, and periodically trains the neural network
     def run(self):
+        #the training process is forked rather than spawned, since a spawned process would run the arbitrator again on start up
+        if self.sharedWeights is not None:
+            self.worker = multiprocessing.get_context("fork").Process(target=self.trainWorker, args=(os.getpid(),), daemon=True)
+            self.worker.start()
+
         error = 1
         while True:
             #Every 30 seconds record the current state table, expected rewards, and weight matrix
             if time.time() - self.time > 30:
-                with open("observations/rewards.dat", 'wb') as outFile:
-                    pickle.dump(self.expectedRewards, outFile)
-
-                with open("observations/targets.dat", 'wb') as outFile:
-                    pickle.dump(self.targets, outFile)
+                #the keys are counted first, the table always holds at least as many states as there are keys
+                count = len(self.stateKeys)
+                with open("observations/table.dat", 'wb') as outFile:
+                    pickle.dump((self.stateKeys[:count], self.table.values[:count].copy(), self.table.targets[:count].copy()), outFile)
 
-                with open("observations/states.dat", 'wb') as outFile:
-                    pickle.dump(self.states, outFile)
+                weights = self.NN.weights
+                if self.sharedWeights is not None:
+                    weights = self.sharedWeights.read()
 
                 name = ""
-                for x in self.NN.weights:
+                for x in weights:
                     name += (str(np.shape(x)) + ",")
 
                 with open("observations/"+name, 'wb') as outFile:
-                    pickle.dump(self.NN.weights, outFile)
+                    pickle.dump(weights, outFile)
 
                 self.time = time.time()
 
@@ -244,38 +281,92 @@ class Brain(threading.Thread):
             if self.quit:
                 break
 
-            #If the state table is not empty train the network
-            if len(self.states) > 0:
-                #randomize the expected rewards
-                try:
-                    sample = len(self.states)
-                    
-                    inputs = random.sample(self.states, sample)
-                    
-                    targets = [self.targets[k] for k in inputs]
-                except:
-                    print("##########################################")
-                    continue
+            #report the error of the weights most recently published by the training process
+            if self.sharedWeights is not None:
+                error = self.sharedWeights.error()
+                if not np.isnan(error):
+                    self.error.append(error)
+                    print("Error: " + str(error))
+                continue
 
-                #Train the network for 100 iterations on the random sample
-                #note that the random sample contains all 
+            #If the state table is not empty train the network
+            if len(self.table) > 0:
+                #every state is trained on at once so their order does not matter
+                #the inputs of a state never change so they are used in place, targets are copied since they may be updated during training
+                count = len(self.table)
+                inputs = self.table.inputs[:count]
+                targets = self.table.targets[:count].copy()
+
+                #Train the network for up to 100 iterations, unless it already fits every state closely
                 if error > 0.05:
-                    self.NN.train(inputs, targets, 100, 0.01, 0.1)
+                    self.trainNetwork(inputs, targets)
 
                 #report the current error
-                results = self.NN.getOutputs(inputs, 0.01)
-
-                for x in range(len(targets)):
-                    partialSum = 0
-                    for y in range(len(targets[0])):
-                        partialSum += (targets[x][y] - results[1][x][y])**2
-                    error += partialSum
-
-                error = error/len(targets)
+                error = self.NN.error(inputs, targets, 0.01)
                 self.error.append(error)
                 print("Error: " + str(error))
 
+        if self.worker is not None:
+            self.sharedWeights.stop()
+            self.worker.join(5)
+            if self.worker.is_alive():
+                self.worker.terminate()
+            self.table.unlink()
+            self.sharedWeights.unlink()
+
         print("nn quit")
 
+    #This method runs in the training process, it trains the network on the shared table without pausing and publishes the weights after each round of training
+    #it stops when asked to, or if the process which started it has exited
+    def trainWorker(self, parentId):
+        #the process is forked while other threads may hold the network's lock, so it is given its own
+        self.NN.lock = threading.Lock()
+        generation = self.sharedWeights.table()[0]
+        error = 1
+        while not self.sharedWeights.stopping() and os.getppid() == parentId:
+            #follow the table when it grows into a new block of shared memory
+            latest, name = self.sharedWeights.table()
+            if latest != generation:
+                try:
+                    self.table.attach(name)
+                except FileNotFoundError:
+                    continue
+                generation = latest
+
+            count = len(self.table)
+            if count == 0:
+                time.sleep(1)
+                continue
+            inputs = self.table.inputs[:count]
+            targets = self.table.targets[:count].copy()
+
+            #once the network fits every state closely it is only checked each second, until the targets change
+            if error > 0.05:
+                self.trainNetwork(inputs, targets)
+            else:
+                time.sleep(1)
+
+            error = self.NN.error(inputs, targets, 0.01)
+            self.sharedWeights.publish(self.NN.weightsForUse, self.NN.beta, error)
+
+        #the process ends without the usual clean up, which flushes output streams whose locks may have been held by other threads when it was forked
+        os._exit(0)
+
+    #This method trains the network on the given states as configured, see __init__
+    def trainNetwork(self, inputs, targets):
+        deadline = None
+        if self.trainBudget is not None:
+            deadline = time.time() + self.trainBudget
+
+        if self.validationFraction is None:
+            self.NN.train(inputs, targets, 100, 0.01, 0.1, self.trainBatch, deadline=deadline)
+            return
+
+        #the same states are held out every time so the network is never trained on them, otherwise their error would not show overfitting
+        held = np.arange(len(inputs)) % int(round(1/self.validationFraction)) == 0
+        if np.all(held):
+            return
+        self.NN.train(inputs[~held], targets[~held], 100, 0.01, 0.1, self.trainBatch, (inputs[held], targets[held]), self.patience, deadline)
+
     def shutdown(self):
         self.quit = True
\ No newline at end of file
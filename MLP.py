@@ -5,6 +5,7 @@
 import numpy as np
 from threading import Lock
 import random
+import time
 
 class MLP():
     def __init__(self, structure, seed):
@@ -13,6 +14,7 @@ class MLP():
         random.seed(seed)
 
         self.lock = Lock()
+        self.sharedWeights = None
 
         self.structure = structure
         self.beta = 0.1
@@ -29,10 +31,11 @@ class MLP():
     #numEpochs indicates the number of runs to perform with the input data
     #beta is a parameter used to control for overflow in the logistic function
     #dropout is a parameter which specifies the size of a randomly chosen portion of the network to not be trained
-    def train(self, inputs, targets, numEpochs, beta, dropout):
-        
-        alpha = 0.01
-       
+    #batchSize, if given, splits each epoch into randomly chosen batches of that many inputs, with the weights updated after each batch
+    #validation, if given, is a pair of inputs and targets which are not trained on, training stops once their error has not improved for patience epochs and the weights with the lowest error are kept
+    #deadline, if given, is the time at which training stops after the current epoch
+    #returns the error on the validation set of the weights kept, or None without a validation set
+    def train(self, inputs, targets, numEpochs, beta, dropout, batchSize=None, validation=None, patience=5, deadline=None):
         
         alphas = []
         
@@ -43,75 +46,41 @@ class MLP():
 
         oldGrads = [] 
 
-        #an array to hold the change in weights
-        deltaWs = []
-        for x in range(len(self.weights)):
-            deltaWs.append(np.zeros((np.shape(self.weights[x]))))
+        inputs = np.asarray(inputs)
+        targets = np.asarray(targets)
+        if batchSize is None or batchSize >= len(inputs):
+            batchSize = len(inputs)
 
-        #modify inputs to align properly with the bias nodes
-        inputsWithBias = np.concatenate((inputs, np.ones((len(inputs), 1))), axis=1)
+        bestError = None
+        bestWeights = None
+        epochsSinceBest = 0
 
         #for each epoch train the network
         for x in range(numEpochs):
-            
-            #an array for temporary weights for implementing dropout
-            tmpWeights = []
-            for y in range(len(self.weights)):
-                tmpWeights.append(np.copy(self.weights[y]))
-                rand = np.random.rand(len(self.weights[y]), len(self.weights[y][0]))
-                #if some random value is less than the given dropout rate replace the weight with a zero
-                tmpWeights[y][rand < dropout] = 0
-
-            #perform the forward pass
-            outputs = self.getOutputs(inputs, beta)
-
-            ErrsWRTweights = []
-
-            #Calculate errors at the output layer
-            #ie the DeltaOs
-            ErrOutput = (outputs[-1] - targets)*outputs[-1]*(1.0 - outputs[-1])
-            ErrsWRTweights.insert(0, ErrOutput)
-
-           
-            #get the portion of error for each node based on the values of the weights and the error at each output node
-            ErrPortion = np.dot(ErrsWRTweights[0], np.transpose(tmpWeights[1]))
-
-         
-            #calculate deltahs
-            DerWRTNode = beta*outputs[0]*(1.0 - outputs[0])*ErrPortion
-            ErrsWRTweights.insert(0, DerWRTNode)
-
-          
-            #calculate the weight updates
-            #compute the sum of the gradients for all of the given inputs at each node
-            #use this sum to compute the weight update
-            gradSums = []
-            gradSums.append(np.dot(np.transpose(inputsWithBias),DerWRTNode[:,:-1]))
-            
-            gradSums.append(np.dot(np.transpose(outputs[0]),ErrsWRTweights[1]))
-            
-            #If there are gradients from a previous run
-            #ie this is not the first run
-            if len(oldGrads) > 0: 
-                #compute the change in sign of gradient for each weight
-                for y in range(len(self.weights)):
-                    sign = gradSums[y]*oldGrads[y]
-                
-                    #where the sign has not changed increase the learning rate
-                    alphas[y][sign>0] = alphas[y][sign>0]*1.1
-         
-                    #where the sign has changed decrease the learning rate
-                    alphas[y][sign < 0]*= 0.9
-                                       
-            oldGrads = gradSums
-
-            #compute the new weight
-            deltaWs[0] = alphas[0]*(gradSums[0]) 
-            deltaWs[1] = alphas[1]*(gradSums[1]) 
-
-            #finally we update the weights
-            for y in range(len(self.weights)):
-                self.weights[y] -= deltaWs[y]
+            if batchSize == len(inputs):
+                oldGrads = self.trainBatch(inputs, targets, beta, dropout, alphas, oldGrads)
+            else:
+                order = np.random.permutation(len(inputs))
+                for start in range(0, len(inputs), batchSize):
+                    batch = order[start:start + batchSize]
+                    oldGrads = self.trainBatch(inputs[batch], targets[batch], beta, dropout, alphas, oldGrads)
+
+            if validation is not None:
+                error = self.error(validation[0], validation[1], beta)
+                if bestError is None or error < bestError:
+                    bestError = error
+                    bestWeights = [np.copy(w) for w in self.weights]
+                    epochsSinceBest = 0
+                else:
+                    epochsSinceBest += 1
+                    if epochsSinceBest >= patience:
+                        break
+
+            if deadline is not None and time.time() >= deadline:
+                break
+
+        if bestWeights is not None:
+            self.weights = bestWeights
 
         #After training completes record a copy of the weights for use by the robot
         #This ensures that the robot does not attempt to generate an action while weights are being updated
@@ -123,6 +92,76 @@ class MLP():
         self.beta = beta
         self.lock.release()
 
+        return bestError
+
+    #This method performs one update of the weights from a batch of inputs using rProp
+    #alphas are the learning rates of each weight, which are adapted in place, and oldGrads are the gradients of the previous update
+    #returns the gradients of this update
+    def trainBatch(self, inputs, targets, beta, dropout, alphas, oldGrads):
+
+        #an array for temporary weights for implementing dropout
+        tmpWeights = []
+        for y in range(len(self.weights)):
+            tmpWeights.append(np.copy(self.weights[y]))
+            rand = np.random.rand(len(self.weights[y]), len(self.weights[y][0]))
+            #if some random value is less than the given dropout rate replace the weight with a zero
+            tmpWeights[y][rand < dropout] = 0
+
+        #modify inputs to align properly with the bias nodes
+        inputsWithBias = np.concatenate((inputs, np.ones((len(inputs), 1))), axis=1)
+
+        #perform the forward pass
+        outputs = self.getOutputs(inputs, beta)
+
+        ErrsWRTweights = []
+
+        #Calculate errors at the output layer
+        #ie the DeltaOs
+        ErrOutput = (outputs[-1] - targets)*outputs[-1]*(1.0 - outputs[-1])
+        ErrsWRTweights.insert(0, ErrOutput)
+
+       
+        #get the portion of error for each node based on the values of the weights and the error at each output node
+        ErrPortion = np.dot(ErrsWRTweights[0], np.transpose(tmpWeights[1]))
+
+     
+        #calculate deltahs
+        DerWRTNode = beta*outputs[0]*(1.0 - outputs[0])*ErrPortion
+        ErrsWRTweights.insert(0, DerWRTNode)
+
+      
+        #calculate the weight updates
+        #compute the sum of the gradients for all of the given inputs at each node
+        #use this sum to compute the weight update
+        gradSums = []
+        gradSums.append(np.dot(np.transpose(inputsWithBias),DerWRTNode[:,:-1]))
+        
+        gradSums.append(np.dot(np.transpose(outputs[0]),ErrsWRTweights[1]))
+        
+        #If there are gradients from a previous run
+        #ie this is not the first run
+        if len(oldGrads) > 0: 
+            #compute the change in sign of gradient for each weight
+            for y in range(len(self.weights)):
+                sign = gradSums[y]*oldGrads[y]
+            
+                #where the sign has not changed increase the learning rate
+                alphas[y][sign>0] = alphas[y][sign>0]*1.1
+     
+                #where the sign has changed decrease the learning rate
+                alphas[y][sign < 0]*= 0.9
+
+        #finally we update the weights
+        for y in range(len(self.weights)):
+            self.weights[y] -= alphas[y]*gradSums[y]
+
+        return gradSums
+
+    #This method returns the mean over the inputs of the summed squared error of the outputs
+    def error(self, inputs, targets, beta):
+        outputs = self.getOutputs(inputs, beta)
+        return float(np.mean(np.sum((np.asarray(targets) - outputs[-1])**2, axis=1)))
+
     #This method performs a forward pass for the training method
     def getOutputs(self, inputs, beta):
         #add a column of ones to the inputs to account for the bias neurons
@@ -142,25 +181,48 @@ class MLP():
 
         return outputs
 
+    #This method publishes the weights for use through a SharedWeights, so a network trained in another process can be used by this one
+    #once shared, getAction uses the weights most recently published rather than this network's own
+    def share(self, sharedWeights):
+        self.sharedWeights = sharedWeights
+        self.lock.acquire()
+        sharedWeights.publish(self.weightsForUse, self.beta)
+        self.lock.release()
+
     #This method performs a forward pass for the robot to choose an action
     #It uses a separate weight array to prevent conflicts
     def getAction(self, state):
         
         #add a column of ones to the inputs to account for the bias neurons
         stateWithBias = np.concatenate(([state], np.ones((len([state]), 1))), axis=1)
+
+        #shared weights are used in place, and the pass is repeated if they were overwritten while in use
+        if self.sharedWeights is not None:
+            while True:
+                version, weights, beta = self.sharedWeights.current()
+                outputs = self.forward(stateWithBias, weights, beta)
+                if self.sharedWeights.valid(version):
+                    return outputs
+
         self.lock.acquire()
+        outputs = self.forward(stateWithBias, self.weightsForUse, self.beta)
+        self.lock.release()
+
+        return outputs
+
+    #This method performs a forward pass of a single input, which already includes the bias input, with the given weights
+    def forward(self, stateWithBias, weights, beta):
         #calculate outputs for all inputs for the first layer
-        outputs = np.array(np.dot(stateWithBias, self.weightsForUse[0]))
-        outputs = 1.0/(1.0 + np.exp(-outputs*self.beta))
+        outputs = np.array(np.dot(stateWithBias, weights[0]))
+        outputs = 1.0/(1.0 + np.exp(-outputs*beta))
 
         #calculate outputs for all other layers and append to the list
         outputs = [outputs]
         
         for x in range(len(self.structure)-2):
             outputs[x] = np.concatenate((outputs[x], np.ones((len(outputs[x]), 1))), axis=1)
-            outputs.append(np.dot(outputs[x], self.weightsForUse[x+1]))
-            outputs[x+1] = 1.0/(1.0 + np.exp(-outputs[x+1]*self.beta))
-        self.lock.release()
+            outputs.append(np.dot(outputs[x], weights[x+1]))
+            outputs[x+1] = 1.0/(1.0 + np.exp(-outputs[x+1]*beta))
 
         return outputs[-1][0]
 
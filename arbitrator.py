@@ -1,91 +1,125 @@
 """
     This file serves as the main thread of control for the robot.It initializes, and acts as a buffer between the various other components.
+    To run without the robot's hardware pass a simulated world, python arbitrator.py --sim world.npy
+    Other options are described where they are read from sys.argv
 """
 
-from queue import Queue
+from queue import Empty
 import threading
 from datastore import DataStore
 import random
 import time
 from Brain import Brain
-from pi.motor2 import step
-from pi.ultratest2 import read
 from math import cos
 from math import sin
-from math import sqrt
 from math import radians
-from math import degrees
-from math import pi
+from math import floor
 import sys
 import pickle
-
+import numpy as np
+from chunkwindow import ChunkWindow
+from channel import Channel
+from mapping import integrateSweep
+from mapping import maxPool
+from planner import GridPlanner
+
+#use either the simulator or the robot's motors and sensor
+if "--sim" in sys.argv:
+    from simulator import Simulator
+    simulation = Simulator(sys.argv[sys.argv.index("--sim")+1])
+    step = simulation.step
+    read = simulation.read
+else:
+    from pi.motor2 import step
+    from pi.ultratest2 import read
 
 
 chunkX = 0
 chunkY = 0
 
-jobBuffer = Queue()
-readingBuffer = Queue()
+#a new reading wakes the control loop, and a new action wakes the low level controller
+#readings are kept in order and the oldest is dropped if the control loop falls behind, while only the most recent action is ever performed
+jobBuffer = Channel(1, "coalesce")
+readingBuffer = Channel(16, "dropOldest")
+
+#the time between readings from the sensor, and the time the control loop waits for a reading before continuing without one
+sensorInterval = 0.015
+readingTimeout = 1
+
+#the time from each sensor sample to the action chosen from it being performed
+latencies = []
+
+#the servo direction at which the sensor faces straight ahead
+forwardDirection = 120
+
+#in sweep mode the sensor is turned across the servo's range, and a reading is taken at each of these directions before every action
+#python arbitrator.py --sweep
+if "--sweep" in sys.argv:
+    sensorDirections = list(range(0, 181, 12))
+else:
+    sensorDirections = [forwardDirection]
 
 #This method is initialized as a thread, and acts as the low level controller. It is responsible for reading from sensors, and carrying out the desired operations.
+#Each reading passed to the control loop holds a list of (direction, distance) samples and the position of the robot when they were taken
 def sensorThread(jobs, readings):
 
-    count = 0
-    distSum = 0
+    #the sum and number of distances read at each direction since the last action
+    distSums = [0 for x in sensorDirections]
+    counts = [0 for x in sensorDirections]
+    nextDirection = 0
+    sampleTime = 0
     xCoord = 0
     yCoord = 0
     orientation = 0
     stepSize = 8
-    
-    direction = 120
-
-    reading = read(direction)
 
-    readings.put((reading[1], xCoord, yCoord, orientation))
-    loopCounter = 0
-    gotReading = False
+    samples = []
+    for direction in sensorDirections:
+        reading = read(direction)
+        if len(reading) >= 2:
+            samples.append((direction, reading[1]))
 
+    readings.put((samples, xCoord, yCoord, orientation, time.time()))
 
     while True:
-        #if the sensor has had time to take another reading get it
-        if loopCounter == 15:
-            reading = read(direction)
-            loopCounter = 0
-            gotReading = True
+        #wait for an action to perform, if none arrives before the sensor is ready take another reading
+        try:
+            job, jobTime = jobs.get(sensorInterval)
+            latencies.append(time.time() - jobTime)
+        except Empty:
+            job = None
+
+        #if the sensor has had time to take another reading take one in the next direction
+        #if an action has arrived take a reading in every direction which has not been read since the last action
+        if job is None:
+            toRead = [nextDirection]
+            nextDirection = (nextDirection + 1) % len(sensorDirections)
         else:
-            gotReading = False
-        loopCounter+=1 
+            toRead = [x for x in range(len(sensorDirections)) if counts[x] == 0]
+
+        for x in toRead:
+            reading = read(sensorDirections[x])
 
-        #if reading from the sensor succeeded 
-        if gotReading:
             #If the reading is invalid disregard it
             if len(reading) < 2:
                 print(":(")
-                continue
-            #otherwise record the observed distance
-            dist = reading[1]
-            distSum += dist
-            count += 1
-
-        gotReading = False
-        time.sleep(0.001)
+            else:
+                #otherwise record the observed distance
+                distSums[x] += reading[1]
+                counts[x] += 1
+                sampleTime = time.time()
 
-        #check for an action to perform
-        try:
-            job = jobs.get(True, 0.001)
-        except:
+        if job is None:
             continue
         
-        #Before moving place the currently read distance in the buffer
-        #if multiple readings were performed they are averaged        
-        while count > 0:
-            try:
-                readings.put((distSum/count, xCoord, yCoord, orientation), True, 0.001)
-                distSum = 0
-                count = 0
-            except:
-                print(sys.exc_info()[0])
+        #Before moving place the currently read distances in the buffer
+        #if multiple readings were performed in a direction they are averaged
+        samples = [(sensorDirections[x], distSums[x]/counts[x]) for x in range(len(sensorDirections)) if counts[x] > 0]
+        if len(samples) > 0:
+            if not readings.put((samples, xCoord, yCoord, orientation, sampleTime)):
                 print("put reading failed")
+        distSums = [0 for x in sensorDirections]
+        counts = [0 for x in sensorDirections]
 
         #perform the action
         if job[0] == 1 and job[1] == 1 and job[2] == 1 and job[3] == 1 and job[4] == 1:
@@ -110,11 +144,13 @@ def sensorThread(jobs, readings):
 
 sensorReader = threading.Thread(target=sensorThread, args=(jobBuffer, readingBuffer))
 
-#channels for communicating with the dataStore
-outChannel = Queue()
-inChannel = Queue()
+#python arbitrator.py --map <directory>, keep the map on disk in the given directory, reopening it if it exists
+if "--map" in sys.argv:
+    mapDirectory = sys.argv[sys.argv.index("--map")+1]
+else:
+    mapDirectory = None
 
-dataBank = DataStore(outChannel, inChannel, 100)
+dataBank = DataStore(100, mapDirectory)
 
 dataBank.start()
 sensorReader.start()
@@ -126,11 +162,8 @@ yCoord = 0
 time.sleep(2)
 
 #load the initial blank grid
-grid = []
-for x in range(-1, 2):
-    grid.append([])
-    for y in range(-1, 2):
-        grid[x+1].append(dataBank.get(x, y))
+#the 3x3 chunks around the robot are held in a single 300x300 array so readings can be integrated with numpy
+window = ChunkWindow(dataBank, 0, 0)
 
 xVect = 1
 yVect = 0
@@ -144,36 +177,53 @@ oldChunkX = 0
 oldChunkY = 0
 
 #Although the datastore is capbale of generating a path from the robot to a node in need of exploration this feature has not been fully integrated. Difficulty training the neural network interfered with the integration of this feature.
+#A new path to the chunk most in need of exploration is requested each time the robot changes chunk, the request is a future which completes when the path has been found
 path = []
+pathRequest = None
 
 NNInputSize = 10
 
+#readings outside of this range are disregarded
+minRange = 5
+maxRange = 50
+
+#the robot does not recieve utility while an obstruction is within this many cells
+safetyRadius = 15
+
 score = 0
 oldScore = 0
 scores = []
 
 action = [0,0,0,0,0]
 
-dist = 0
+readingTime = time.time()
 #Initialize the Q-Learning algorithm with a learning rate of 0.2, discount = 0.99, and a seed of 44
-NeuNet = Brain(10, 0.2, 0.99, 44)
+#python arbitrator.py --prioritized, replay experiences in proportion to the size of their last update rather than uniformly
+#python arbitrator.py --trainProcess, train the network in a separate process so training does not slow the control loop
+brainOptions = {"prioritized": "--prioritized" in sys.argv, "trainProcess": "--trainProcess" in sys.argv}
+
+#python arbitrator.py --minibatch, train the network on batches of states for at most half a second each cycle, stopping early once the error on held out states stops improving
+if "--minibatch" in sys.argv:
+    brainOptions.update(trainBatch=256, trainBudget=0.5, validationFraction=0.1)
+NeuNet = Brain(NNInputSize, 0.2, 0.99, 44, **brainOptions)
 
 NeuNet.start()
 
 theWalk = []
 
-#these are helper methods used to interact with the map
-def getFromGrid(x, y):
-    return grid[int(x/100)][int(y/100)][x%100][y%100]
+#python arbitrator.py --planner, drive towards unexplored space with the grid planner rather than the neural network
+usePlanner = "--planner" in sys.argv
+planner = GridPlanner()
+orientation = 0
 
-def putToGrid(x,y,val):
-    grid[int(x/100)][int(y/100)][x%100][y%100] = val
+#the chunks around the robot are only written to the data store as they leave the window, so they are also written as often as the data store takes snapshots of the map
+lastFlush = time.time()
 
 #The main control loop
 someCtr = 0
+startTime = time.time()
 while True:
     
-    time.sleep(0.001)
     someCtr+= 1
 
     #exit after 1000 iterations
@@ -182,110 +232,42 @@ while True:
         break
     change = 0
     try:
-        #check for readings from the low level controller
-        reading = readingBuffer.get(True, 0.001)
+        #wait for a reading from the low level controller
+        reading = readingBuffer.get(readingTimeout)
         
-        dist = reading[0]
+        readingTime = reading[4]
+
+        #compute a unit vector in the direction of each sample
+        #The servo direction is measured relative to the direction the robot is facing
+        directions = np.array([sample[0] for sample in reading[0]])
+        dists = np.array([sample[1] for sample in reading[0]], dtype=float)
+        angles = np.radians(reading[3] + (directions - forwardDirection))
+        print("angle: " + str(reading[3]))
+
+        orientation = reading[3]
+        xVect = cos(radians(orientation))
+        yVect = sin(radians(orientation))
 
-        #If the observation is reasonably close
+        #Only observations which are reasonably close are used
         #this helps reduce noisy sensor readings
         #The minimum distance ensures that the system does not recieve a bonus to utility for driving into objects
-        if dist < 50 and dist > 5:
-            
-            #compute a unit vector in the direction of the reading
-            angle = radians(reading[3])
-            print("angle: " + str(degrees(angle)))
-            
-            if (angle >= 0 and angle < pi/2) or angle == 360:
-                x = cos(angle)*dist
-                y = -sin(angle)*dist
-            elif angle >= pi/2 and angle < pi:
-                y = -cos(angle-(pi/2))*dist
-                x = -sin(angle - (pi/2))*dist
-            elif angle >= pi and angle < 3*pi/2:
-                x = -cos(angle - pi)*dist
-                y =  sin(angle - pi)*dist
-            else:
-                y = cos(angle-(3*pi/2))*dist
-                x =  sin(angle-(3*pi/2))*dist
-      
-            if dist != 0:
-                norm = sqrt((x*x) + (y*y))
-            else:
-                norm = 1
-            x = x/norm
-            y = y/norm
-            xVect = x 
-            yVect = y 
-            a = 0
-            b = 0
+        useful = (dists < maxRange) & (dists > minRange)
+
+        if np.any(useful):
             origX = ((xCoord+50)%100) + 100
             origY = ((yCoord+50)%100) + 100
             
             oldScore = score
             
-            #follow the unit vector through the grid, updating each point as appropriate
-            while sqrt((a*a) + (b*b)) < dist:
-                #This allows the width of the line of sight of the robot to be varied
-                for i in range(0, 1):
-                    #if we have exceeded the boundries of the grid break
-                    if origX + a + i < 0 or origX + a + i >= 300 or origY + b < 0 or origY + b >= 300:
-                        break
-                    
-                    else:
-                        #otherwise updated the value at the current point
-                        oldVal = getFromGrid(int(origX + a+i),int(origY + b))
-                        newScore = (oldVal + (oldVal/1.5))/2
-                        if oldVal > 1:
-                            print("empty loop")
-                            print("big oldVal")
-                            break
-                        if newScore > 1:
-                            print("empty loop")
-                            print("big new score")
-                            break
-                        if newScore < 0:
-                            putToGrid(int(origX + a+i), int(origY + b), 0)
-                        else:
-                            putToGrid(int(origX + a+i), int(origY + b), newScore)
-                #move one unit further along the vector
-                a += x
-                b += y
-            
-            change = 0
-            #If we have not exceeded the bounds of the grid, mark the final position as an obstruction
-            if a + origX >= 0 and a + origX < 300 and b + origY >=0 and b + origY < 300:
-                
-                oldVal = getFromGrid(int(a+origX), int(b+origY))
-                newScore = (oldVal + ((oldVal+1)/2))/2
-
-                if oldVal > 1:
-                    print("big oldVal")
-                    break
-                if newScore > 1:
-                    print("big new score")
-                    break
-
-                if newScore > 1:
-                    putToGrid(int(a+origX),int(origY+b), 1)
-                else:
-                    putToGrid(int(a+origX),int(origY+b), newScore)
-                
-                
-                change = getFromGrid(int(a+origX), int(b+origY)) - oldVal
+            #mark every cell along the line of sight of each sample as free, and the final positions as obstructions
+            changes = integrateSweep(window, origX, origY, np.cos(angles[useful]), np.sin(angles[useful]), dists[useful])
              
-                print(str(oldVal) + " " + str(getFromGrid(int(a+origX), int(b+origY))))
-
-                #if the system was not confident in the contents of a point and the system has not become too close to an obstructed point update utility
-                if change > 0.1:
-                    obstructed = False
-                    for p in range(-15, 15):
-                        for q in range(-15, 15):
-                            if getFromGrid(int(xCoord+p), int(yCoord+q)) > 0.5:
-                                obstructed = True
-                    if not obstructed:
-                        score += change
-                
+            #if the system was not confident in the contents of a point and the system has not become too close to an obstructed point update utility
+            change = changes[changes > 0.1].sum()
+            if change > 0:
+                if not window.obstructedWithin(int(origX), int(origY), safetyRadius):
+                    score += change
+            
         print("score: " + str(score))
             
         #Record the robots current position so that its path through space can be observed
@@ -309,7 +291,7 @@ while True:
             chunkX = int((xCoord+50)/100)
 
         if yCoord < 0:
-            chunky = int((yCoord-50)/100)
+            chunkY = int((yCoord-50)/100)
         else:
             chunkY = int((yCoord+50)/100)
         
@@ -324,123 +306,30 @@ while True:
     #If the robot has moved to a new chunk
     if chunkX != oldChunkX or chunkY != oldChunkY:
         
-        #updated the grid, and add a connection to the data store
-        if chunkY == oldChunkY:
-            #if the robot has moved up 1 chunk
-            if chunkX < oldChunkX:
-                del grid[2]
-                newRow = []
-                newRow.append(dataBank.get(chunkX-1, chunkY-1))
-                newRow.append(dataBank.get(chunkX-1, chunkY))
-                newRow.append(dataBank.get(chunkX-1, chunkY+1))
-                grid.insert(0, newRow)
-                dataBank.connect((oldChunkX, oldChunkY), (chunkX,chunkY), [-1, 0])
-
-            #else if the robot has moved down 1 chunk
-            elif chunkX > oldChunkX:
-                del grid[0]
-                newRow = []
-                newRow.append(dataBank.get(chunkX+1, chunkY-1))
-                newRow.append(dataBank.get(chunkX+1, chunkY))
-                newRow.append(dataBank.get(chunkX+1, chunkY+1))
-                grid.append(newRow)
-                dataBank.connect((oldChunkX, oldChunkY), (chunkX,chunkY), [1, 0])
-        elif chunkY > oldChunkY:
-            #if the robot has moved right and up 1 chunk
-            if chunkX < oldChunkX:
-                del grid[2]
-                del grid[1][0]
-                del grid[0][0]
-                newRow = []
-                newRow.append(dataBank.get(chunkX-1, chunkY-1))
-                newRow.append(dataBank.get(chunkX-1, chunkY))
-                newRow.append(dataBank.get(chunkX-1, chunkY+1))
-                grid.insert(0, newRow)
-                grid[1].append(dataBank.get(chunkX , chunkY+1))
-                grid[2].append(dataBank.get(chunkX +1, chunkY+1))
-                dataBank.connect((oldChunkX, oldChunkY), (chunkX,chunkY), [-1, 1])
-            #else if the robot has moved right and down 1 chunk
-            elif chunkX > oldChunkX:
-                del grid[0]
-                del grid[1][0]
-                del grid[2][0]
-                newRow = []
-                newRow.append(dataBank.get(chunkX+1, chunkY-1))
-                newRow.append(dataBank.get(chunkX+1, chunkY))
-                newRow.append(dataBank.get(chunkX+1, chunkY+1))
-                grid.append(newRow)
-
-                grid[1].append(0,dataBank.get(chunkX, chunkY+1))
-                grid[0].append(0,dataBank.get(chunkX-1, chunkY+1))
-                dataBank.connect((oldChunkX, oldChunkY), (chunkX,chunkY), [1, 1])
-            #else the robot has moved right 1 chunk
-            else:
-                del grid[0][0]
-                del grid[1][0]
-                del grid[2][0]
-                grid[0].append(dataBank.get(chunkX-1, chunkY+1))
-                grid[1].append(dataBank.get(chunkX, chunkY+1))
-                grid[2].append(dataBank.get(chunkX+1, chunkY+1))
-                dataBank.connect((oldChunkX, oldChunkY), (chunkX,chunkY), [0, 1])
-        elif chunkY < oldChunkY:
-            #if the robot has moved left and up 1 chunk
-            if chunkX < oldChunkX:
-                del grid[2]
-                newRow = []
-                newRow.append(dataBank.get(chunkX-1, chunkY-1))
-                newRow.append(dataBank.get(chunkX-1, chunkY))
-                newRow.append(dataBank.get(chunkX-1, chunkY+1))
-                grid.insert(0, newRow)
-
-                del grid[1][2]
-                del grid[2][2]
-
-                grid[1].insert(0, dataBank.get(chunkX, chunkY-1))
-                grid[2].insert(0, dataBank.get(chunkX+1, chunkY-1))
-
-                dataBank.connect((oldChunkX, oldChunkY), (chunkX,chunkY), [-1, -1])
-
-            #else if the robot has moved left and down 1 chunk
-            elif chunkX > oldChunkX:
-                del grid[0]
-                newRow = []
-                newRow.append(dataBank.get(chunkX+1, chunkY-1))
-                newRow.append(dataBank.get(chunkX+1, chunkY))
-                newRow.append(dataBank.get(chunkX+1, chunkY+1))
-                grid.append(newRow)
-
-                del grid[0][2]
-                del grid[1][2]
-                grid[1].insert(0,dataBank.get(chunkX, chunkY-1))
-                grid[0].insert(0,dataBank.get(chunkX-1, chunkY-1))
-                dataBank.connect((oldChunkX, oldChunkY), (chunkX,chunkY), [1, -1])
-            #else the robot has moved left 1 chunk
-            else:
-                del grid[0][2]
-                del grid[1][2]
-                del grid[2][2]
-                grid[0].insert(0,dataBank.get(chunkX-1, chunkY-1))
-                grid[1].insert(0,dataBank.get(chunkX, chunkY-1))
-                grid[2].insert(0,dataBank.get(chunkX+1, chunkY-1))
-                dataBank.connect((oldChunkX, oldChunkY), (chunkX,chunkY), [0, -1])
+        #update the window, and add a connection to the data store
+        window.recenter(chunkX, chunkY)
+        dataBank.setPosition(chunkX, chunkY)
+        if abs(chunkX - oldChunkX) <= 1 and abs(chunkY - oldChunkY) <= 1:
+            dataBank.connect((oldChunkX, oldChunkY), (chunkX,chunkY), [chunkX - oldChunkX, chunkY - oldChunkY])
+        pathRequest = dataBank.submitPath()
         
         oldChunkX = chunkX
         oldChunkY = chunkY
 
+    if readingTime - lastFlush > dataBank.snapshotInterval:
+        window.flush()
+        lastFlush = readingTime
+
+    #collect the most recently computed path, if there is one
+    if pathRequest is not None and pathRequest.done():
+        if not pathRequest.cancelled():
+            path = pathRequest.result()
+        pathRequest = None
+
     #reduce the dimensionality of the grid so it will be suitable to use as input to the NN
-    NNInput = [[0 for x in range(NNInputSize)] for y in range(NNInputSize)]
-    chunkSize = int(300/NNInputSize)
-    
-    #reduce the grid to a 10x10 array where each cell is given the maximum value of all corresponding cells in the grid
-    for a in range(len(grid)):
-        for b in range(len(grid[a])):
-            for x in range(NNInputSize):
-                for y in range(10):
-                    for row in range(NNInputSize):
-                        val = max(grid[a][b][x+row][y:y+10])
-                        cur = NNInput[int(((a*100)+(x*10))/chunkSize)][int(((b*100)+(y*10))/chunkSize)]
-                        if val > cur:
-                            NNInput[int(((a*100)+(x*10))/chunkSize)][int(((b*100)+(y*10))/chunkSize)] = val
+    #the window is max pooled so each cell of the input is given the maximum value of all corresponding cells in the grid
+    NNInput = maxPool(window.asArray(), NNInputSize)
+    chunkSize = 300/NNInputSize
 
     #Add markers to the neural network input indicating the position and orientation of the robot
     if xCoord + 150 < 0:
@@ -451,8 +340,8 @@ while True:
         yCoordInNNInput = 300 - ((yCoord+150)%300)
     else:
         yCoordInNNInput = (yCoord +150) % 300
-    xCoordInNNInput = int(xCoordInNNInput/30)
-    yCoordInNNInput = int(yCoordInNNInput/30)
+    xCoordInNNInput = int(xCoordInNNInput/chunkSize)
+    yCoordInNNInput = int(yCoordInNNInput/chunkSize)
     NNInput[xCoordInNNInput][yCoordInNNInput] = 10
 
     if xVect > 0:
@@ -467,29 +356,39 @@ while True:
         yMod = -1
     else:
         yMod = 0
-    if xCoordInNNInput + xMod < 10 and xCoordInNNInput + xMod >= 0:
-        if yCoordInNNInput + yMod < 10 and yCoordInNNInput + yMod >= 0:
+    if xCoordInNNInput + xMod < NNInputSize and xCoordInNNInput + xMod >= 0:
+        if yCoordInNNInput + yMod < NNInputSize and yCoordInNNInput + yMod >= 0:
             NNInput[xCoordInNNInput+xMod][yCoordInNNInput+yMod] = 20
     
     
     #submit the input to the neural network to get an action
     action = NeuNet.getAction(score, NNInput) 
 
-    #submit the action to the low level controller
-    try:
-        print(action)
-        jobBuffer.put(action, True, 0.001)
-    except:
-        print("didnt put job")
-        continue
+    #In planner mode the robot follows a path to the nearest frontier instead, while one exists
+    if usePlanner:
+        originX, originY = window.origin()
+        position = (int(floor(xCoord)), int(floor(yCoord)))
+        if planner.explore(window.asArray(), originX, originY, position):
+            action = planner.steer(orientation, position)
+
+    #submit the action to the low level controller, along with the time of the reading it was chosen from
+    print(action)
+    jobBuffer.put((action, readingTime))
 
 #shut down the system
-jobBuffer.put([1,1,1,1,1])
-outChannel.put(["exit"])
+window.flush()
+jobBuffer.put(([1,1,1,1,1], time.time()))
+dataBank.shutdown()
 NeuNet.shutdown()
 
 
 print("ending")
+print("ticks per second: " + str(someCtr/(time.time() - startTime)))
+if len(latencies) > 0:
+    print("mean latency: " + str(sum(latencies)/len(latencies)) + " max latency: " + str(max(latencies)))
+print("readings dropped: " + str(readingBuffer.dropped))
+if usePlanner:
+    print("replans: " + str(planner.replans))
 
 #record information about this run
 name = "run30"
@@ -504,16 +403,16 @@ aFile.write(s)
 
 aFile.close()
 
-with open("paths/"+name+"map", 'wb') as outFile:
-    cells = []
-    for x in dataBank.chunks.keys():
-        cells.append((x, dataBank.chunks[x].grid))
-    pickle.dump(cells, outFile) 
+#the map is written in the format read by MapReader
+dataBank.export("paths/"+name+"map")
 
 with open("paths/"+name+"score", 'wb') as outFile:
     pickle.dump(scores, outFile)
     print(scores)
 
+with open("paths/"+name+"latency", 'wb') as outFile:
+    pickle.dump(latencies, outFile)
+
 with open("paths/"+name+"error", 'wb') as outFile:
     pickle.dump(NeuNet.error, outFile)
     print(NeuNet.error)
@@ -0,0 +1,55 @@
+"""
+    This class provides a bounded buffer for passing items between threads.
+    Readers wait on a condition and are woken as soon as an item is available, instead of polling.
+    When the buffer is full the policy decides which item is lost:
+        "dropOldest" discards the oldest buffered item
+        "dropNewest" discards the item being put
+        "coalesce" replaces everything buffered with the new item, so a reader only ever sees the latest item
+"""
+
+import threading
+from collections import deque
+from queue import Empty
+
+class Channel(object):
+
+    def __init__(self, capacity, policy="dropOldest"):
+        if policy not in ("dropOldest", "dropNewest", "coalesce"):
+            raise ValueError("unknown policy: " + str(policy))
+
+        self.capacity = capacity
+        self.policy = policy
+        self.items = deque()
+        self.condition = threading.Condition()
+
+        #the number of items lost to the policy
+        self.dropped = 0
+
+    #This method adds an item to the buffer and wakes a waiting reader
+    #returns False if the item was discarded
+    def put(self, item):
+        with self.condition:
+            if self.policy == "coalesce":
+                self.dropped += len(self.items)
+                self.items.clear()
+            elif len(self.items) >= self.capacity:
+                self.dropped += 1
+                if self.policy == "dropNewest":
+                    return False
+                self.items.popleft()
+
+            self.items.append(item)
+            self.condition.notify()
+        return True
+
+    #This method removes the oldest item from the buffer, waiting up to timeout seconds for one to arrive
+    #As with queue.Queue, queue.Empty is raised if no item arrives in time
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.items) > 0, timeout):
+                raise Empty
+            return self.items.popleft()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.items)
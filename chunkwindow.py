@@ -0,0 +1,151 @@
+"""
+    This class holds the 3x3 chunks of the map surrounding the robot in a single preallocated array.
+    Chunks are placed in the array toroidally, the chunk (x, y) always occupies the slot (x%3, y%3), so recentering only replaces the chunks which leave the window.
+    A summed area table of obstructed cells is kept alongside the array so the window can be checked for nearby obstructions in constant time.
+"""
+
+import numpy as np
+
+class ChunkWindow(object):
+
+    def __init__(self, dataStore, chunkX, chunkY, chunkSize=100, obstructionThreshold=0.5):
+        self.dataStore = dataStore
+        self.chunkSize = chunkSize
+        self.size = chunkSize*3
+        self.shape = (self.size, self.size)
+
+        self.grid = np.zeros(self.shape, dtype=np.float32)
+
+        #cells with a value above the threshold are considered obstructed
+        #the summed area table has an extra leading row and column of zeros, and is only rebuilt from the first row which has changed
+        self.obstructionThreshold = obstructionThreshold
+        self.obstructed = np.zeros(self.shape, dtype=np.int32)
+        self.table = np.zeros((self.size+1, self.size+1), dtype=np.int32)
+        self.dirtyRow = 0
+
+        #the coordinates of the chunk loaded into each slot of the array, and whether it has been written since it was loaded
+        self.coords = [[None for y in range(3)] for x in range(3)]
+        self.dirty = np.zeros((3, 3), dtype=bool)
+
+        self.chunkX = chunkX
+        self.chunkY = chunkY
+        for x in range(chunkX-1, chunkX+2):
+            for y in range(chunkY-1, chunkY+2):
+                self.loadChunk(x, y)
+        self.setOffset()
+
+    #The offset maps a position in the window to its position in the array
+    #position (0, 0) of the window is the first cell of the chunk (chunkX-1, chunkY-1)
+    def setOffset(self):
+        self.offX = ((self.chunkX-1) % 3)*self.chunkSize
+        self.offY = ((self.chunkY-1) % 3)*self.chunkSize
+
+    #Cells are accessed with a single index, window[x, y], where x and y may be integers or arrays of integers
+    def __getitem__(self, key):
+        return self.grid[(key[0] + self.offX) % self.size, (key[1] + self.offY) % self.size]
+
+    def __setitem__(self, key, value):
+        x = (np.asarray(key[0]) + self.offX) % self.size
+        y = (np.asarray(key[1]) + self.offY) % self.size
+        self.grid[x, y] = value
+        self.dirty[x//self.chunkSize, y//self.chunkSize] = True
+
+        #record the first row of the summed area table which is no longer valid
+        obstructed = self.grid[x, y] > self.obstructionThreshold
+        changed = obstructed != self.obstructed[x, y]
+        if np.any(changed):
+            self.obstructed[x, y] = obstructed
+            self.dirtyRow = min(self.dirtyRow, int(np.min(x[changed] if x.ndim > 0 else x)))
+
+    #This method returns True if any cell within radius cells of window position (x, y) is obstructed
+    #The neighbourhood is the square [x-radius, x+radius] x [y-radius, y+radius] clipped to the window
+    def obstructedWithin(self, x, y, radius):
+        self.updateTable()
+
+        x0 = max(x - radius, 0)
+        x1 = min(x + radius + 1, self.size)
+        y0 = max(y - radius, 0)
+        y1 = min(y + radius + 1, self.size)
+        if x0 >= x1 or y0 >= y1:
+            return False
+
+        #the neighbourhood may wrap around the edges of the array, so it is split into at most four rectangles
+        total = 0
+        for rows in self.splitRange(x0, x1, self.offX):
+            for cols in self.splitRange(y0, y1, self.offY):
+                total += self.table[rows[1], cols[1]] - self.table[rows[0], cols[1]] - self.table[rows[1], cols[0]] + self.table[rows[0], cols[0]]
+
+        return total > 0
+
+    #This method maps the window range [start, end) to at most two contiguous ranges of the array
+    def splitRange(self, start, end, offset):
+        length = end - start
+        start = (start + offset) % self.size
+        if start + length <= self.size:
+            return [(start, start + length)]
+        return [(start, self.size), (0, start + length - self.size)]
+
+    #This method rebuilds the rows of the summed area table which have been invalidated since it was last used
+    def updateTable(self):
+        if self.dirtyRow >= self.size:
+            return
+        row = self.dirtyRow
+        rowSums = np.cumsum(self.obstructed[row:], axis=1)
+        self.table[row+1:, 1:] = self.table[row, 1:] + np.cumsum(rowSums, axis=0)
+        self.dirtyRow = self.size
+
+    #This method returns the world cell at position (0, 0) of the window
+    #chunk (x, y) covers the world cells centered on (x*chunkSize, y*chunkSize)
+    def origin(self):
+        return (self.chunkX-1)*self.chunkSize - self.chunkSize//2, (self.chunkY-1)*self.chunkSize - self.chunkSize//2
+
+    #This method returns the contents of the window as a contiguous array ordered from the top left chunk
+    #If the window is not offset no copy is made
+    def asArray(self):
+        if self.offX == 0 and self.offY == 0:
+            return self.grid
+        return np.roll(self.grid, (-self.offX, -self.offY), axis=(0, 1))
+
+    #This method moves the window so that it is centered on the given chunk
+    #only chunks leaving the window are written back to the data store, and only chunks entering the window are fetched
+    def recenter(self, chunkX, chunkY):
+        if chunkX == self.chunkX and chunkY == self.chunkY:
+            return
+
+        for x in range(chunkX-1, chunkX+2):
+            for y in range(chunkY-1, chunkY+2):
+                if abs(x - self.chunkX) > 1 or abs(y - self.chunkY) > 1:
+                    self.storeChunk(x % 3, y % 3)
+                    self.loadChunk(x, y)
+
+        self.chunkX = chunkX
+        self.chunkY = chunkY
+        self.setOffset()
+
+    #This method writes every chunk in the window which has been modified back to the data store
+    def flush(self):
+        for slotX in range(3):
+            for slotY in range(3):
+                self.storeChunk(slotX, slotY)
+
+    #This method fetches a chunk from the data store into its slot
+    def loadChunk(self, x, y):
+        slotX = x % 3
+        slotY = y % 3
+        chunk = self.dataStore.get(x, y)
+        self.grid[self.slot(slotX, slotY)] = chunk
+        self.obstructed[self.slot(slotX, slotY)] = self.grid[self.slot(slotX, slotY)] > self.obstructionThreshold
+        self.dirtyRow = min(self.dirtyRow, slotX*self.chunkSize)
+        self.coords[slotX][slotY] = (x, y)
+        self.dirty[slotX, slotY] = False
+
+    #This method writes the contents of a slot back to the data store, if it has been modified
+    #chunks which are never written are not allocated by the data store
+    def storeChunk(self, slotX, slotY):
+        if self.dirty[slotX, slotY]:
+            x, y = self.coords[slotX][slotY]
+            self.dataStore.put(x, y, self.grid[self.slot(slotX, slotY)])
+            self.dirty[slotX, slotY] = False
+
+    def slot(self, slotX, slotY):
+        return (slice(slotX*self.chunkSize, (slotX+1)*self.chunkSize), slice(slotY*self.chunkSize, (slotY+1)*self.chunkSize))
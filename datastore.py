@@ -1,24 +1,86 @@
 """
     This class serves as the information store. It stores chunks that are currently not local to the robot, and is capable of pathfinding. It should be noted that path finding has not been fully integrated into the system. Difficulty training the neural network made pathfind capabilities unnecessary.
+    If given a directory the map is kept on disk, see TileStore, along with the links between chunks in graph.npy, so it is reopened when the system restarts.
+    Reduced resolution copies of every chunk are kept alongside them, see MapPyramid, for coarse views of the map, as is the frontier between observed and unobserved cells, see FrontierIndex.
+    Writing the map to disk never holds the lock, a snapshot of the modified chunks and the graph is taken under the lock and written by a separate writer thread.
 """
 
 import threading
+import os
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 from math import sqrt
-import time
-import pickle
+import numpy as np
+import heapq
+from collections import OrderedDict
+from indexedheap import IndexedHeap
+from tilestore import TileStore
+from snapshotlog import SnapshotLog
+from pyramid import MapPyramid
+from frontier import FrontierIndex
+from mapfile import writeMap
+
+#the cost of moving diagonally between chunks
+diagonalCost = sqrt(2)
+
+#the directions in which a chunk may be linked to its neighbours
+linkDirections = [(-1, 0), (1,0), (0,1), (0,-1), (-1,1), (-1,-1), (1,1), (1,-1)]
+
+#the layout of graph.npy, one row per chunk
+graphType = np.dtype([('x', np.int32), ('y', np.int32), ('links', np.uint8), ('certainty', np.float64), ('visited', np.bool_)])
 
 class DataStore(threading.Thread):
     
-    def __init__(self, inChannel, outChannel, size):
+    def __init__(self, size, mapDirectory=None, memoryBudget=64*2**20, workers=2, snapshotInterval=5):
         threading.Thread.__init__(self)
         self.chunks = {}
-        self.inChannel = inChannel
-        self.outChannel = outChannel
+        self.size = size
+        self.mapDirectory = mapDirectory
+
+        #the grids of all chunks which have been written
+        #the memory budget is shared with the pyramid so that both hold the same number of chunks
+        tileBytes = size*size*4
+        self.tiles = TileStore(size, mapDirectory, memoryBudget*tileBytes//(tileBytes + MapPyramid.chunkBytes(size)))
+
+        #chunks which have never been written share a single read only grid
+        #a chunk is only given its own grid the first time it is written
+        self.unknown = np.full((size, size), 0.5, dtype=np.float32)
+        self.unknown.setflags(write=False)
+
+        #the block maxima and means of each chunk at several resolutions, updated as chunks are written
+        self.pyramid = MapPyramid(size, self.tiles.capacity)
+
+        #the free cells bordering unobserved cells, updated as chunks are written
+        self.frontier = FrontierIndex(size)
+
+        #the map is periodically written to an append only log, see SnapshotLog, the chunks modified since the last snapshot are recorded so only they are written
+        #A map kept in memory starts a new log, a map kept on disk continues the log in its own directory
+        if mapDirectory is None:
+            self.snapshots = SnapshotLog("currentMap/map.log", size, reset=True)
+        else:
+            self.snapshots = SnapshotLog(os.path.join(mapDirectory, "map.log"), size)
+        self.modified = set()
+
+        #snapshots waiting to be written to disk, and the thread which writes them
+        #the number of seconds between snapshots
+        self.snapshotInterval = snapshotInterval
+        self.writeQueue = Queue()
+        self.writer = threading.Thread(target=self.writeSnapshots)
+
+        #the chunks the robot has visited, ordered by how well they are known
+        #only visited chunks are considered for exploration since only they are linked to the rest of the map
+        self.priorities = IndexedHeap()
+
+        if mapDirectory is not None and os.path.exists(self.graphFile()):
+            self.loadGraph()
+
         for x in range(-1, 2):
             for y in range(-1, 2):
-                grid = [[0.5 for x in range(size)] for y in range(size)]
-                self.chunks[(x,y)] = self.Node(grid, x,y)
-        self.size = size
+                if (x, y) not in self.chunks:
+                    self.chunks[(x,y)] = self.Node(x,y)
+
+        if (0, 0) not in self.priorities:
+            self.priorities.push((0, 0), self.chunks[(0, 0)].known)
 
         self.xIndex = 0
         self.yIndex = 0
@@ -27,138 +89,397 @@ class DataStore(threading.Thread):
         self.worstX = 0
         self.worstY = 0
 
+        #the links between chunks as a dictionary from each chunk to the directions it is linked in, rebuilt only after a link is added
+        #the copy is never modified once made, so searches use it without holding the lock
+        self.linkCount = 0
+        self.linkCopy = None
+        self.linkCopyCount = -1
+
+        #the search trees of the most recently used goals, so each goal's tree can be reused while the links are unchanged
+        self.searches = OrderedDict()
+        self.searchLock = threading.Lock()
+        self.maxSearches = 4
+
         self.lock = threading.Lock()
 
+        #paths are found by a pool of worker threads, requests which are waiting or being searched are kept so identical requests share a result
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.requests = {}
+        self.requestLock = threading.Lock()
+
+        #set when the data store should write the map one last time and stop
+        self.stopping = threading.Event()
+
     #This method is used to retrieve an chunk from the data store
+    #chunks are stored as float32 arrays of probabilities, the grid returned must not be modified, use put instead
     def get(self, x, y):
         self.lock.acquire()
         
         #If the chunk does not exist create it
         if (x, y) not in self.chunks:
-            grid = [[0.5 for a in range(self.size)] for b in range(self.size)]
-            self.chunks[(x, y)] = self.Node(grid, x, y)
+            self.chunks[(x, y)] = self.Node(x, y)
 
-        chunk = self.chunks[(x,y)].grid
+        chunk = self.gridOf((x, y))
         self.lock.release()
         return chunk
 
-    #This method executes in a separate thread, and would be used for path finding if it had been integrated.
+    #This method returns the grid of a chunk, the caller must hold the lock
+    def gridOf(self, key):
+        grid = self.tiles.get(key[0], key[1])
+        if grid is None:
+            return self.unknown
+        return grid
+
+    #This method is used to write the contents of a chunk to the data store
+    def put(self, x, y, grid):
+        self.lock.acquire()
+
+        if (x, y) not in self.chunks:
+            self.chunks[(x, y)] = self.Node(x, y)
+
+        grid = np.asarray(grid, dtype=np.float32)
+        node = self.chunks[(x, y)]
+        oldGrid = self.gridOf((x, y))
+        changed = node.write(oldGrid, grid)
+        self.pyramid.update((x, y), oldGrid, grid, changed)
+        self.tiles.put(x, y, grid)
+        self.frontier.update((x, y), self.gridOf, changed)
+        self.modified.add((x, y))
+        if (x, y) in self.priorities:
+            self.priorities.push((x, y), node.known)
+
+        self.lock.release()
+
+    #This method returns a chunk at a reduced resolution, each value is the maximum or mean of a factor by factor block of cells
+    #the grid returned must not be modified
+    def coarse(self, x, y, factor, statistic="max"):
+        self.lock.acquire()
+        grid = self.coarseOf((x, y), factor, statistic)
+        self.lock.release()
+        return grid
+
+    #This method returns a chunk at a reduced resolution, the caller must hold the lock
+    #chunks read from disk are added to the pyramid the first time they are used
+    def coarseOf(self, key, factor, statistic):
+        grid = self.pyramid.level(key, factor, statistic)
+        if grid is None:
+            full = self.tiles.get(key[0], key[1])
+            if full is None:
+                return self.pyramid.unknown[factor]
+            self.pyramid.build(key, full)
+            grid = self.pyramid.level(key, factor, statistic)
+        return grid
+
+    #This method returns the chunks from (x0, y0) up to but not including (x1, y1) at a reduced resolution, as a single array
+    def overview(self, x0, y0, x1, y1, factor, statistic="max"):
+        width = self.size//factor
+        grid = np.empty(((x1 - x0)*width, (y1 - y0)*width), dtype=np.float32)
+        self.lock.acquire()
+        for x in range(x0, x1):
+            for y in range(y0, y1):
+                grid[(x - x0)*width:(x - x0 + 1)*width, (y - y0)*width:(y - y0 + 1)*width] = self.coarseOf((x, y), factor, statistic)
+        self.lock.release()
+        return grid
+
+    #This method returns the clusters of frontier cells, ranked by their size and their distance from the robot, see FrontierIndex.clusters
+    def frontiers(self):
+        self.lock.acquire()
+        clusters = self.frontier.clusters(self.xIndex, self.yIndex)
+        self.lock.release()
+        return clusters
+
+    #This method returns the visited chunk most in need of exploration, and how well it is known
+    def leastExplored(self):
+        self.lock.acquire()
+        chunk, known = self.priorities.peek()
+        self.lock.release()
+        return chunk[0], chunk[1], known
+
+    #This method executes in a separate thread, periodically writing the current map to disk so it can be examined while the system continues to explore
     def run(self):
-        ctr = 0
+        self.writer.start()
+        while not self.stopping.wait(self.snapshotInterval):
+            print("writing grid")
+            self.writeQueue.put(self.snapshot())
+
+        self.pool.shutdown(wait=True)
+        self.writeQueue.put(self.snapshot())
+        self.writeQueue.put(None)
+        self.writer.join()
+        print("datastore quit")    
+
+    #This method stops the data store's thread once the map has been written
+    def shutdown(self):
+        self.stopping.set()
+
+    #This method requests a path from start to goal, by default from the robot to the chunk most in need of exploration
+    #returns a future which completes with the result of findPath, identical requests which have not completed share a future
+    def submitPath(self, start=None, goal=None):
+        self.lock.acquire()
+        if start is None:
+            start = (self.xIndex, self.yIndex)
+        if goal is None:
+            goal = self.priorities.peek()[0]
+        self.lock.release()
+
+        request = (start, goal)
+        self.requestLock.acquire()
+        future = self.requests.get(request)
+        submitted = future is None
+        if submitted:
+            future = self.pool.submit(self.findPath, start, goal)
+            self.requests[request] = future
+        self.requestLock.release()
+
+        #the callback runs immediately if the search has already finished, so it is added once the lock is released
+        if submitted:
+            future.add_done_callback(lambda done: self.finished(request, done))
+        return future
+
+    #This method forgets a request once its future completes or is cancelled
+    def finished(self, request, future):
+        self.requestLock.acquire()
+        if self.requests.get(request) is future:
+            del self.requests[request]
+        self.requestLock.release()
+
+    #This method cancels the requests which have not started and no longer start at the robot's chunk
+    def cancelStale(self, x, y):
+        self.requestLock.acquire()
+        stale = [future for (start, goal), future in self.requests.items() if start != (x, y)]
+        self.requestLock.release()
+        for future in stale:
+            future.cancel()
+
+    #This method captures the state of the map which has not yet been written to disk
+    #grids are never modified once stored, so only references to the modified grids are taken while the lock is held
+    #returns the chunks modified since the last snapshot, the tiles not yet written to the map directory, and the rows of graph.npy and frontier.npy
+    def snapshot(self):
+        self.lock.acquire()
+        cells = [(key, self.gridOf(key)) for key in self.modified]
+        self.modified = set()
+        tiles = self.tiles.snapshot()
+        graph = (self.graphRows(), self.frontier.rows()) if self.mapDirectory is not None else None
+        self.lock.release()
+        return cells, tiles, graph
+
+    #This method writes a snapshot to disk without holding the lock, except to mark the written tiles as clean
+    def writeSnapshot(self, snapshot):
+        cells, tiles, graph = snapshot
+        self.snapshots.append(cells)
+        if self.mapDirectory is None:
+            return
+
+        self.tiles.writeSnapshot(tiles)
+        self.saveGraph(graph)
+
+        self.lock.acquire()
+        self.tiles.markWritten(tiles)
+        self.lock.release()
+
+    #This method executes in the writer thread, writing snapshots until it is given None
+    def writeSnapshots(self):
         while True:
-            #periodically write the current map to disk so it can be examined while the system continues to explore
-            time.sleep(0.25)
-            if ctr == 20:
-                print("writing grid")
-                with open("currentMap/map.dat", 'wb') as outFile:
-                    self.lock.acquire()
-                    cells = []
-                    for x in self.chunks.keys():
-                        cells.append((x,self.chunks[x].grid))
-                    pickle.dump(cells, outFile) 
-                    self.lock.release()
-                ctr = 0
-            
-            ctr += 1
-            
-            #If a request for a path has been submitted
-            try:
-                item = self.inChannel.get(False, 0.01)
-            except:
-                continue
-
-            #calculate the path and place it in the output buffer
-            if item[0] == "path":
-            
-                thePath = self.findPath()
-               
-                try:
-                    self.outChannel.put(thePath)
-                except:
-                    print("exception")
-                
-            elif item[0] == "exit":
+            snapshot = self.writeQueue.get()
+            if snapshot is None:
                 break
+            self.writeSnapshot(snapshot)
 
-        print("datastore quit")    
+    #This method writes the map to disk immediately, it must not be used while the data store's thread is running
+    def flush(self):
+        self.writeSnapshot(self.snapshot())
+
+    #This method writes every chunk which has been written to a map file, see writeMap
+    #chunks are read and written one at a time, holding the lock only while each is read, and are not made resident
+    def export(self, fileName, compress=False):
+        self.lock.acquire()
+        keys = sorted(self.tiles.keys())
+        self.lock.release()
+        writeMap(fileName, self.exportChunks(keys), self.size, compress)
+
+    def exportChunks(self, keys):
+        for key in keys:
+            self.lock.acquire()
+            grid = self.tiles.read(key[0], key[1])
+            self.lock.release()
+            yield key, grid
+
+    def graphFile(self):
+        return os.path.join(self.mapDirectory, "graph.npy")
+
+    def frontierFile(self):
+        return os.path.join(self.mapDirectory, "frontier.npy")
+
+    #This method returns every chunk's links, certainty, and whether it has been visited as the rows of graph.npy, the caller must hold the lock
+    #links are stored as a bit mask, one bit for each entry of linkDirections
+    def graphRows(self):
+        graph = np.zeros(len(self.chunks), dtype=graphType)
+        for row, (key, node) in enumerate(self.chunks.items()):
+            links = 0
+            for bit, direction in enumerate(linkDirections):
+                if node.links[direction] is not None:
+                    links |= 1 << bit
+            graph[row] = (key[0], key[1], links, node.certainty, key in self.priorities)
+        return graph
+
+    #This method writes the rows of graph.npy, and the frontier cells of each chunk to frontier.npy
+    def saveGraph(self, graph):
+        for fileName, rows in zip((self.graphFile(), self.frontierFile()), graph):
+            temporary = fileName + ".tmp.npy"
+            np.save(temporary, rows)
+            os.replace(temporary, fileName)
+
+    #This method rebuilds the chunks, their links, the exploration priorities, and the frontier from disk
+    def loadGraph(self):
+        if os.path.exists(self.frontierFile()):
+            self.frontier.load(np.load(self.frontierFile()))
+
+        graph = np.load(self.graphFile())
+        for row in graph:
+            node = self.Node(int(row['x']), int(row['y']))
+            node.certainty = float(row['certainty'])
+            node.known = (node.certainty/(self.size*self.size))*2
+            self.chunks[(node.X, node.Y)] = node
+            if row['visited']:
+                self.priorities.push((node.X, node.Y), node.known)
+
+        for row in graph:
+            node = self.chunks[(int(row['x']), int(row['y']))]
+            for bit, direction in enumerate(linkDirections):
+                if int(row['links']) & (1 << bit):
+                    node.links[direction] = self.chunks[(node.X + direction[0], node.Y + direction[1])]
 
     #This method is used to create a link between two adjacent nodes
     #Adjacent nodes are only linked when the robot travels between them, this ensures that a calculated path is viable 
     def connect(self, chunk1, chunk2, direction):
         self.lock.acquire()
         if direction[0] != 0 or direction[1] != 0:
+            #a new link may shorten paths, so the previous searches can no longer be reused
+            if self.chunks[chunk1].links[(direction[0], direction[1])] is None:
+                self.linkCount += 1
             self.chunks[chunk1].links[(direction[0], direction[1])] = self.chunks[chunk2]
             self.chunks[chunk2].links[((-direction[0]), (-direction[1]))] = self.chunks[chunk1]
         self.lock.release()
 
+    #This method records the chunk currently occupied by the robot
+    def setPosition(self, x, y):
+        self.lock.acquire()
+        self.xIndex = x
+        self.yIndex = y
+        if (x, y) not in self.priorities:
+            self.priorities.push((x, y), self.chunks[(x, y)].known)
+        self.lock.release()
 
-    #This method runs an iterative deepending search to find a path
-    def findPath(self):
-        #continue until a path is found
-        #At this time a path is guaranteed to exist since this method only finds a path from the robot to the node most in need of additional examination
-        level = 1
-        while True:
-            #Unset all exploration flags
-            for chunk in self.chunks.values():
-                chunk.tested = False
-          
-            #perform a search to the current level
-            path = self.testLevel(self.worstX, self.worstY, 0, level)
-
-            #If no path is found try one level deeper, otherwise return the path
-            if path is None or path:
-                return path
-            else:
-                level += 1
-
-    #This method performs a depth first from the lowest scored chunk to the robot, or the maximum level, whichever is reached first
-    def testLevel(self, x, y, level, maxLevel):
-        
-        if level == maxLevel:
-            return []
+        #paths from the chunk the robot has left are no longer needed
+        self.cancelStale(x, y)
 
-        #get the starting chunk
-        chunk = self.chunks[(x,y)]
-        
-        #If the robot is in this chunk return 
-        if x == self.xIndex and y == self.yIndex:
-            return [(x,y)]
+    #This method runs an A* search over the links between chunks to find a path from start to goal, by default from the robot to the chunk most in need of exploration
+    #The lock is only held to copy the links, so several searches may run at once while the map continues to be used
+    #returns a list of chunk coordinates starting at start and ending at the goal, or None if no path exists
+    def findPath(self, start=None, goal=None):
+        self.lock.acquire()
 
-        #Set the tested flag and explore adjacent chunks
-        chunk.tested = True
-        
-        for adjacent in chunk.links.items():
-            
-            if (adjacent[1] is not None) and (not adjacent[1].tested):
-                
-                step = self.testLevel(x + adjacent[0][0], y + adjacent[0][1], level+1, maxLevel)
-            
-                if step is not None:
-                    if step:
-                        step.append((x,y))
-                        return step
-                    else:
-                        return []
-
-        return None
+        if goal is None:
+            (self.worstX, self.worstY), self.worstScore = self.priorities.peek()
+            goal = (self.worstX, self.worstY)
+        if start is None:
+            start = (self.xIndex, self.yIndex)
+        if goal not in self.chunks or start not in self.chunks:
+            self.lock.release()
+            return None
+
+        if self.linkCopyCount != self.linkCount:
+            self.linkCopy = dict((key, [direction for direction, adjacent in node.links.items() if adjacent is not None]) for key, node in self.chunks.items())
+            self.linkCopyCount = self.linkCount
+        links = self.linkCopy
+        linkCount = self.linkCount
+        self.lock.release()
+
+        #reuse the goal's search tree if the links have not changed since it was built
+        self.searchLock.acquire()
+        search = self.searches.get(goal)
+        if search is None or search.linkCount != linkCount:
+            search = self.Search(goal, linkCount)
+            self.searches[goal] = search
+        self.searches.move_to_end(goal)
+        while len(self.searches) > self.maxSearches:
+            self.searches.popitem(last=False)
+        self.searchLock.release()
+
+        return search.path(start, links)
+
+    #This method computes the octile distance between two chunks, the cost of the shortest path if every link existed
+    @staticmethod
+    def octile(a, b):
+        dx = abs(a[0] - b[0])
+        dy = abs(a[1] - b[1])
+        return max(dx, dy) + (diagonalCost - 1)*min(dx, dy)
+
+    #This class holds the A* search tree towards a single goal
+    #The search runs backwards from the goal, so while the goal and links are unchanged the tree can be reused when the robot moves, only expanding it as far as the robot's new position
+    class Search(object):
+        def __init__(self, goal, linkCount):
+            self.goal = goal
+            self.linkCount = linkCount
+            self.costs = {goal:0}
+            self.parents = {goal:None}
+            self.closed = set()
+            self.open = [(0, 0, goal)]
+            self.start = goal
+            self.lock = threading.Lock()
+
+        #This method expands the tree until it reaches start, links is the copy made by findPath
+        #returns the path from start to the goal, or None if no path exists
+        def path(self, start, links):
+            self.lock.acquire()
+            if start not in self.closed and start != self.start:
+                #the heuristic depends on the robot's position, so the open list must be reordered
+                self.open = [(cost + DataStore.octile(node, start), cost, node) for (estimate, cost, node) in self.open]
+                heapq.heapify(self.open)
+                self.start = start
+
+            while start not in self.closed:
+                if not self.open:
+                    self.lock.release()
+                    return None
+
+                estimate, cost, node = heapq.heappop(self.open)
+                if node in self.closed or cost > self.costs[node]:
+                    continue
+                self.closed.add(node)
+
+                for direction in links.get(node, ()):
+                    nextNode = (node[0] + direction[0], node[1] + direction[1])
+                    nextCost = cost + (diagonalCost if direction[0] != 0 and direction[1] != 0 else 1)
+                    if nextCost < self.costs.get(nextNode, float('inf')):
+                        self.costs[nextNode] = nextCost
+                        self.parents[nextNode] = node
+                        heapq.heappush(self.open, (nextCost + DataStore.octile(nextNode, start), nextCost, nextNode))
+
+            #follow the search tree from start back to the goal
+            path = []
+            node = start
+            while node is not None:
+                path.append(node)
+                node = self.parents[node]
+            self.lock.release()
+            return path
 
     #This class is used to store chunks of the map
     class Node(object):
-        def __init__(self, grid, x, y):
-            self.update(grid)
+        def __init__(self, x, y):
+            #certainty is the sum of each cell's distance from 0.5, known scales it to [0, 1]
+            #a chunk which has never been written is entirely unknown
+            self.certainty = 0
+            self.known = 0
             self.X = x 
             self.Y = y
-            self.links = {(-1, 0):None, (1,0):None, (0,1):None, (0,-1):None, (-1,1):None, (-1,-1):None, (1,1):None, (1,-1):None}
-            self.tested = False
-
-            self.X = 0
-            self.Y = 0
+            self.links = dict((direction, None) for direction in linkDirections)
         
-        #This method updates the current chunk
-        def update(self, grid):
-            self.grid = grid
-            total = 0
-            for x in grid:
-                for y in x:
-                    total += abs(0.5 - y)
-            self.known = (total/(len(grid)*len(grid[0])))*2
+        #This method records new values written to the current chunk, only the cells which have changed contribute to the change in certainty
+        #returns a boolean array of the cells which have changed
+        def write(self, oldGrid, grid):
+            changed = grid != oldGrid
+            self.certainty += float(np.abs(0.5 - grid[changed]).sum() - np.abs(0.5 - oldGrid[changed]).sum())
+            self.known = (self.certainty/grid.size)*2
+            return changed
@@ -0,0 +1,177 @@
+"""
+    This class keeps track of the frontier of the map, the free cells which border unobserved cells, as chunks are written.
+    Only the cells around those which changed are re-examined, including the edges of neighbouring chunks when a change reaches the edge of a chunk.
+    Frontier cells are counted in square blocks of world cells, and clusters are the groups of touching blocks which contain frontier cells.
+    Clusters are only recomputed after the frontier changes, so they can be queried cheaply on every tick.
+    The frontier cells of each chunk are kept packed one bit per cell, and can be saved and restored with the map so it is not recomputed from every chunk.
+"""
+
+import numpy as np
+from math import sqrt
+
+class FrontierIndex(object):
+
+    def __init__(self, chunkSize, blockSize=10):
+        self.chunkSize = chunkSize
+        self.blockSize = blockSize
+
+        #the frontier cells of each chunk packed one bit per cell, arrays are replaced rather than modified
+        self.masks = {}
+        self.maskType = np.dtype([('x', np.int32), ('y', np.int32), ('mask', np.uint8, ((chunkSize*chunkSize + 7)//8,))])
+
+        #for each block containing frontier cells, the number of cells and the sums of their world coordinates
+        self.blocks = {}
+
+        #the clusters found since the frontier last changed, or None
+        self.groups = None
+
+    #This method updates the frontier after a chunk has been written, changed is a boolean array of the cells which changed
+    #gridOf returns the grid of any chunk, and must already return the new grid of this chunk
+    def update(self, key, gridOf, changed):
+        rows, cols = np.nonzero(changed)
+        if len(rows) == 0:
+            return
+        size = self.chunkSize
+
+        #a cell's frontier status depends on itself and its four neighbours
+        r0 = max(int(rows.min()) - 1, 0)
+        r1 = min(int(rows.max()) + 2, size)
+        c0 = max(int(cols.min()) - 1, 0)
+        c1 = min(int(cols.max()) + 2, size)
+        self.refresh(key, gridOf, r0, r1, c0, c1)
+
+        x, y = key
+        if rows.min() == 0:
+            self.refresh((x - 1, y), gridOf, size - 1, size, c0, c1)
+        if rows.max() == size - 1:
+            self.refresh((x + 1, y), gridOf, 0, 1, c0, c1)
+        if cols.min() == 0:
+            self.refresh((x, y - 1), gridOf, r0, r1, size - 1, size)
+        if cols.max() == size - 1:
+            self.refresh((x, y + 1), gridOf, r0, r1, 0, 1)
+
+    #This method recomputes the frontier cells of a chunk within rows r0 to r1 and columns c0 to c1
+    def refresh(self, key, gridOf, r0, r1, c0, c1):
+        grid = gridOf(key)
+        free = grid[r0:r1, c0:c1] < 0.5
+        if key not in self.masks and not free.any():
+            return
+
+        #the region with a border of one cell, taken from the neighbouring chunks at the edges of the chunk
+        size = self.chunkSize
+        x, y = key
+        padded = np.full((r1 - r0 + 2, c1 - c0 + 2), 0.0, dtype=np.float32)
+        padded[1:-1, 1:-1] = grid[r0:r1, c0:c1]
+        padded[0, 1:-1] = grid[r0 - 1, c0:c1] if r0 > 0 else gridOf((x - 1, y))[size - 1, c0:c1]
+        padded[-1, 1:-1] = grid[r1, c0:c1] if r1 < size else gridOf((x + 1, y))[0, c0:c1]
+        padded[1:-1, 0] = grid[r0:r1, c0 - 1] if c0 > 0 else gridOf((x, y - 1))[r0:r1, size - 1]
+        padded[1:-1, -1] = grid[r0:r1, c1] if c1 < size else gridOf((x, y + 1))[r0:r1, 0]
+
+        unknown = padded == 0.5
+        bordersUnknown = unknown[:-2, 1:-1] | unknown[2:, 1:-1] | unknown[1:-1, :-2] | unknown[1:-1, 2:]
+        frontier = free & bordersUnknown
+
+        mask = self.mask(key)
+        old = mask[r0:r1, c0:c1]
+        added = np.nonzero(frontier & ~old)
+        removed = np.nonzero(old & ~frontier)
+        if len(added[0]) == 0 and len(removed[0]) == 0:
+            return
+
+        mask[r0:r1, c0:c1] = frontier
+        if mask.any():
+            self.masks[key] = np.packbits(mask)
+        else:
+            self.masks.pop(key, None)
+
+        #chunk x covers world cells x*size - size/2 up to x*size + size/2
+        originX = x*size - size//2 + r0
+        originY = y*size - size//2 + c0
+        self.count(originX + added[0], originY + added[1], 1)
+        self.count(originX + removed[0], originY + removed[1], -1)
+        self.groups = None
+
+    #This method returns the frontier cells of a chunk as a boolean array
+    def mask(self, key):
+        if key not in self.masks:
+            return np.zeros((self.chunkSize, self.chunkSize), dtype=bool)
+        return np.unpackbits(self.masks[key], count=self.chunkSize*self.chunkSize).reshape(self.chunkSize, self.chunkSize).astype(bool)
+
+    #This method returns the frontier cells of every chunk as an array of (x, y, packed mask) rows, which can be saved with the map
+    def rows(self):
+        rows = np.zeros(len(self.masks), dtype=self.maskType)
+        for row, (key, packed) in enumerate(self.masks.items()):
+            rows[row] = (key[0], key[1], packed)
+        return rows
+
+    #This method restores the frontier from the rows of a saved map, the chunks themselves are not read
+    def load(self, rows):
+        size = self.chunkSize
+        for row in rows:
+            key = (int(row['x']), int(row['y']))
+            self.masks[key] = np.array(row['mask'])
+            cellsX, cellsY = np.nonzero(self.mask(key))
+            self.count(key[0]*size - size//2 + cellsX, key[1]*size - size//2 + cellsY, 1)
+        self.groups = None
+
+    #This method adds or removes frontier cells, given by their world coordinates, from the counts of their blocks
+    def count(self, cellsX, cellsY, sign):
+        if len(cellsX) == 0:
+            return
+        blocksX = cellsX//self.blockSize
+        blocksY = cellsY//self.blockSize
+        blocks, inverse = np.unique(np.stack([blocksX, blocksY], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse)
+        sumsX = np.bincount(inverse, weights=cellsX)
+        sumsY = np.bincount(inverse, weights=cellsY)
+
+        for i in range(len(blocks)):
+            block = (int(blocks[i, 0]), int(blocks[i, 1]))
+            entry = self.blocks.setdefault(block, [0, 0.0, 0.0])
+            entry[0] += sign*int(counts[i])
+            entry[1] += sign*sumsX[i]
+            entry[2] += sign*sumsY[i]
+            if entry[0] == 0:
+                del self.blocks[block]
+
+    #This method groups the blocks containing frontier cells into clusters of touching blocks
+    #returns a list of (number of cells, centre) pairs, where the centre is the mean world cell of the cluster
+    def findGroups(self):
+        groups = []
+        unvisited = set(self.blocks)
+        while unvisited:
+            stack = [unvisited.pop()]
+            cells = 0
+            sumX = 0.0
+            sumY = 0.0
+            while stack:
+                block = stack.pop()
+                entry = self.blocks[block]
+                cells += entry[0]
+                sumX += entry[1]
+                sumY += entry[2]
+                for dx in (-1, 0, 1):
+                    for dy in (-1, 0, 1):
+                        adjacent = (block[0] + dx, block[1] + dy)
+                        if adjacent in unvisited:
+                            unvisited.remove(adjacent)
+                            stack.append(adjacent)
+            groups.append((cells, (float(sumX/cells), float(sumY/cells))))
+        return groups
+
+    #This method returns the frontier clusters ranked by their size and their distance from the robot's chunk
+    #each cluster is a (score, number of cells, distance, centre) tuple, the score is the number of cells divided by one more than the distance in chunks
+    def clusters(self, chunkX, chunkY):
+        if self.groups is None:
+            self.groups = self.findGroups()
+
+        ranked = []
+        for cells, centre in self.groups:
+            distance = sqrt((centre[0] - chunkX*self.chunkSize)**2 + (centre[1] - chunkY*self.chunkSize)**2)/self.chunkSize
+            ranked.append((cells/(1 + distance), cells, distance, centre))
+        ranked.sort(reverse=True)
+        return ranked
+
+    def __len__(self):
+        return sum(entry[0] for entry in self.blocks.values())
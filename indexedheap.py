@@ -0,0 +1,81 @@
+"""
+    This class implements a binary min heap which keeps the position of each key, so the priority of any key can be changed or removed in O(log n).
+"""
+
+class IndexedHeap(object):
+
+    def __init__(self):
+        #each entry is a [priority, key] pair, positions maps each key to the index of its entry
+        self.heap = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    #This method inserts a key, or changes its priority if it is already in the heap
+    def push(self, key, priority):
+        if key in self.positions:
+            index = self.positions[key]
+            oldPriority = self.heap[index][0]
+            self.heap[index][0] = priority
+            if priority < oldPriority:
+                self.siftUp(index)
+            else:
+                self.siftDown(index)
+        else:
+            self.heap.append([priority, key])
+            self.positions[key] = len(self.heap) - 1
+            self.siftUp(len(self.heap) - 1)
+
+    #This method returns the key with the lowest priority, and its priority, without removing it
+    def peek(self):
+        return self.heap[0][1], self.heap[0][0]
+
+    #This method removes and returns the key with the lowest priority, and its priority
+    def pop(self):
+        key, priority = self.peek()
+        self.remove(key)
+        return key, priority
+
+    def priority(self, key):
+        return self.heap[self.positions[key]][0]
+
+    def remove(self, key):
+        index = self.positions.pop(key)
+        last = self.heap.pop()
+        if index < len(self.heap):
+            self.heap[index] = last
+            self.positions[last[1]] = index
+            self.siftUp(index)
+            self.siftDown(self.positions[last[1]])
+
+    def siftUp(self, index):
+        entry = self.heap[index]
+        while index > 0:
+            parent = (index - 1)//2
+            if self.heap[parent][0] <= entry[0]:
+                break
+            self.heap[index] = self.heap[parent]
+            self.positions[self.heap[index][1]] = index
+            index = parent
+        self.heap[index] = entry
+        self.positions[entry[1]] = index
+
+    def siftDown(self, index):
+        entry = self.heap[index]
+        while True:
+            child = 2*index + 1
+            if child >= len(self.heap):
+                break
+            if child + 1 < len(self.heap) and self.heap[child + 1][0] < self.heap[child][0]:
+                child += 1
+            if entry[0] <= self.heap[child][0]:
+                break
+            self.heap[index] = self.heap[child]
+            self.positions[self.heap[index][1]] = index
+            index = child
+        self.heap[index] = entry
+        self.positions[entry[1]] = index
@@ -0,0 +1,114 @@
+"""
+    These functions write and read maps in a compact binary format.
+    A map file is a header, the grid of each chunk as raw float32 values, or compressed with zlib, and an index of every chunk.
+    The header is the magic bytes AMAP, the format version, the chunk size, the number of chunks, and the offset of the index.
+    Each entry of the index is the chunk's x, y, the offset and length of its payload, and whether the payload is compressed.
+    The index follows the payloads so chunks can be written one at a time, and payloads start on a multiple of 4 bytes so uncompressed grids can be read in place from a memory map of the file.
+    Maps are written to a temporary file which then replaces the old one, so a reader always sees a complete map.
+    MapReader also reads the snapshot log written while the system runs, see SnapshotLog, so the live map can be examined the same way.
+"""
+
+import os
+import mmap
+import struct
+import zlib
+import numpy as np
+from snapshotlog import SnapshotLog
+from snapshotlog import recordHeader
+
+magic = b"AMAP"
+formatVersion = 1
+
+#magic, version, chunk size, number of chunks, index offset
+fileHeader = struct.Struct("<4sIIIQ")
+
+#x, y, payload offset, payload length, compressed
+indexEntry = struct.Struct("<iiQII")
+
+#This function writes a map, chunks is an iterable of ((x, y), grid) pairs which is consumed one chunk at a time
+#if compress is true each grid is compressed separately, so single chunks can still be read without reading the rest of the map
+def writeMap(fileName, chunks, chunkSize, compress=False):
+    temporary = fileName + ".tmp"
+    entries = []
+    with open(temporary, 'wb') as mapFile:
+        #the header is written once the index offset is known
+        mapFile.write(b"\0"*fileHeader.size)
+        for key, grid in chunks:
+            payload = np.ascontiguousarray(grid, dtype=np.float32).tobytes()
+            if compress:
+                payload = zlib.compress(payload)
+            mapFile.write(b"\0"*(-mapFile.tell() % 4))
+            entries.append(indexEntry.pack(key[0], key[1], mapFile.tell(), len(payload), int(compress)))
+            mapFile.write(payload)
+
+        indexOffset = mapFile.tell()
+        mapFile.write(b"".join(entries))
+        mapFile.seek(0)
+        mapFile.write(fileHeader.pack(magic, formatVersion, chunkSize, len(entries), indexOffset))
+    os.replace(temporary, fileName)
+
+class MapReader(object):
+
+    def __init__(self, fileName):
+        #the offset, length, and compression of each chunk's payload
+        self.index = {}
+        self.chunkSize = None
+        self.data = None
+        if os.path.getsize(fileName) == 0:
+            return
+
+        with open(fileName, 'rb') as mapFile:
+            self.data = mmap.mmap(mapFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.data[:len(magic)] != magic:
+            self.readLog()
+            return
+
+        fileMagic, version, self.chunkSize, count, indexOffset = fileHeader.unpack_from(self.data, 0)
+        if version != formatVersion:
+            raise ValueError(fileName + " has unsupported map format version " + str(version))
+
+        for i in range(count):
+            x, y, offset, length, compressed = indexEntry.unpack_from(self.data, indexOffset + i*indexEntry.size)
+            self.index[(x, y)] = (offset, length, compressed)
+
+    #This method indexes the most recent record of each chunk in a snapshot log
+    #the log is read as it was when the reader was created, records appended later are not seen
+    def readLog(self):
+        latest, end = SnapshotLog.records(self.data)
+        for key, offset in latest.items():
+            length = recordHeader.unpack_from(self.data, offset)[2]
+            self.index[key] = (offset + recordHeader.size, length, 0)
+            self.chunkSize = int(round((length//4)**0.5))
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    #This method returns the grid of a chunk, or None if it is not in the map
+    #uncompressed grids are read only views of the file, no data is copied
+    def get(self, x, y):
+        if (x, y) not in self.index:
+            return None
+        offset, length, compressed = self.index[(x, y)]
+        if compressed:
+            payload = zlib.decompress(self.data[offset:offset + length])
+            return np.frombuffer(payload, dtype=np.float32).reshape(self.chunkSize, self.chunkSize)
+        return np.frombuffer(self.data, dtype=np.float32, count=self.chunkSize*self.chunkSize, offset=offset).reshape(self.chunkSize, self.chunkSize)
+
+    #This method returns the chunks from (x0, y0) up to but not including (x1, y1) which are in the map
+    #returns a dictionary from chunk coordinates to grids
+    def region(self, x0, y0, x1, y1):
+        chunks = {}
+        if (x1 - x0)*(y1 - y0) < len(self.index):
+            keys = [(x, y) for x in range(x0, x1) for y in range(y0, y1) if (x, y) in self.index]
+        else:
+            keys = [(x, y) for (x, y) in self.index if x0 <= x < x1 and y0 <= y < y1]
+        for key in keys:
+            chunks[key] = self.get(key[0], key[1])
+        return chunks
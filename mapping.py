@@ -0,0 +1,74 @@
+"""
+    This file provides the vectorized operations used to integrate sensor readings into the occupancy grid held by the robot.
+    All methods operate directly on a two dimensional numpy array, the 300x300 window around the robot.
+"""
+
+import numpy as np
+
+#each cell along the line of sight of a reading has its value scaled by this factor
+#equivalent to the old update (oldVal + (oldVal/1.5))/2
+freeDecay = (1 + (1/1.5))/2
+
+#This method computes the cells crossed by many rays from the same origin at once using a DDA on index arrays
+#origX, origY is the cell the rays start in, and xVects, yVects and dists are arrays with one entry per ray, a unit vector and the length of the ray
+#returns the x and y indices of every cell from the origin up to but not including the end point of every ray, and the x and y indices of the end point of every ray
+#the origin cell is included, as it was by the loop this replaced, so it is decayed as free space along with the rest of the line of sight
+def traceRays(origX, origY, xVects, yVects, dists):
+    endXs = np.floor(origX + xVects*dists).astype(np.intp)
+    endYs = np.floor(origY + yVects*dists).astype(np.intp)
+    startX = int(np.floor(origX))
+    startY = int(np.floor(origY))
+
+    #each ray contributes one cell per step along its major axis
+    steps = np.maximum(np.abs(endXs - startX), np.abs(endYs - startY))
+    ray = np.repeat(np.arange(len(steps)), steps)
+    first = np.cumsum(steps) - steps
+
+    t = (np.arange(len(ray)) - first[ray])/steps[ray]
+    xs = np.floor(startX + t*(endXs[ray] - startX) + 0.5).astype(np.intp)
+    ys = np.floor(startY + t*(endYs[ray] - startY) + 0.5).astype(np.intp)
+
+    return xs, ys, endXs, endYs
+
+#This method integrates a fan of readings taken from the same position into the grid in a single pass, a single reading is a fan of one
+#cells crossed by several rays are decayed once for each ray, and end points hit by several rays are marked once for each ray
+#all free space is applied before any end point is marked
+#returns the change in value contributed by each ray's end point, 0 for rays ending outside the grid or at an end point already counted
+def integrateSweep(grid, origX, origY, xVects, yVects, dists):
+    xs, ys, endXs, endYs = traceRays(origX, origY, np.asarray(xVects), np.asarray(yVects), np.asarray(dists))
+    rows, cols = grid.shape
+
+    inBounds = (xs >= 0) & (xs < rows) & (ys >= 0) & (ys < cols)
+    cells, counts = np.unique(xs[inBounds]*cols + ys[inBounds], return_counts=True)
+    xs = cells//cols
+    ys = cells % cols
+    grid[xs, ys] = np.clip(grid[xs, ys]*(freeDecay**counts), 0, 1)
+
+    changes = np.zeros(len(endXs))
+    inBounds = (endXs >= 0) & (endXs < rows) & (endYs >= 0) & (endYs < cols)
+    if not np.any(inBounds):
+        return changes
+
+    #marking an end point k times moves it to 1 - (1 - oldVal)*0.75**k
+    cells, firstRay, counts = np.unique(endXs[inBounds]*cols + endYs[inBounds], return_index=True, return_counts=True)
+    xs = cells//cols
+    ys = cells % cols
+    oldVals = grid[xs, ys]
+    grid[xs, ys] = np.clip(1 - (1 - oldVals)*(0.75**counts), 0, 1)
+
+    changes[np.flatnonzero(inBounds)[firstRay]] = grid[xs, ys] - oldVals
+    return changes
+
+#This method reduces the grid to an outputSize x outputSize array where each cell is the maximum of all corresponding cells in the grid
+#when the grid does not divide evenly the blocks are sized as evenly as possible
+def maxPool(grid, outputSize):
+    rows, cols = grid.shape
+
+    #if the grid divides evenly the reduction is a single reshape
+    if rows % outputSize == 0 and cols % outputSize == 0:
+        return grid.reshape(outputSize, rows//outputSize, outputSize, cols//outputSize).max(axis=(1, 3))
+
+    rowEdges = (np.arange(outputSize)*rows)//outputSize
+    colEdges = (np.arange(outputSize)*cols)//outputSize
+    pooled = np.maximum.reduceat(grid, rowEdges, axis=0)
+    return np.maximum.reduceat(pooled, colEdges, axis=1)
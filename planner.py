@@ -0,0 +1,300 @@
+"""
+    This class plans paths between cells of the window around the robot.
+    Obstructions are inflated by the size of the robot, and paths are found with A* using jump point search, which skips across open regions of the map in a single step.
+    Paths are kept between calls and only replanned when the goal changes or a cell along the remaining path becomes blocked.
+    Paths are stored in world cells so they remain valid as the window moves.
+"""
+
+import heapq
+import numpy as np
+from math import atan2
+from math import degrees
+from math import sqrt
+
+#the cost of moving diagonally between cells
+diagonalCost = sqrt(2)
+
+class GridPlanner(object):
+
+    def __init__(self, inflation=6, obstructionThreshold=0.5, lookahead=5):
+        #cells within inflation cells of an obstruction are treated as blocked
+        self.inflation = inflation
+        self.obstructionThreshold = obstructionThreshold
+
+        #the number of cells ahead of the robot along the path that it steers towards
+        self.lookahead = lookahead
+
+        self.goal = None
+        self.path = []
+        self.replans = 0
+
+    #This method computes which cells of the window are blocked
+    #returns a boolean array in window coordinates
+    def costMap(self, grid, inflation):
+        obstructed = (grid > self.obstructionThreshold).astype(np.int32)
+        if inflation == 0:
+            return obstructed > 0
+
+        #count the obstructions within inflation cells of every cell using a summed area table
+        rows, cols = grid.shape
+        table = np.zeros((rows+1, cols+1), dtype=np.int32)
+        table[1:, 1:] = np.cumsum(np.cumsum(obstructed, axis=0), axis=1)
+
+        x0 = np.clip(np.arange(rows) - inflation, 0, rows)
+        x1 = np.clip(np.arange(rows) + inflation + 1, 0, rows)
+        y0 = np.clip(np.arange(cols) - inflation, 0, cols)
+        y1 = np.clip(np.arange(cols) + inflation + 1, 0, cols)
+        counts = table[x1][:, y1] - table[x0][:, y1] - table[x1][:, y0] + table[x0][:, y0]
+        return counts > 0
+
+    #This method finds the free cells which border unobserved cells
+    #returns a boolean array in window coordinates
+    def frontier(self, grid, blocked):
+        unknown = grid == 0.5
+        free = (grid < 0.5) & ~blocked
+
+        bordersUnknown = np.zeros(grid.shape, dtype=bool)
+        bordersUnknown[1:] |= unknown[:-1]
+        bordersUnknown[:-1] |= unknown[1:]
+        bordersUnknown[:, 1:] |= unknown[:, :-1]
+        bordersUnknown[:, :-1] |= unknown[:, 1:]
+
+        return free & bordersUnknown
+
+    #This method plans a path from the robot's world cell to the nearest frontier in the window
+    #frontier cells within lookahead cells of the robot are considered reached
+    #The current goal is kept until it is reached or leaves the frontier, so the path can be reused
+    #returns an empty list if there is no reachable frontier
+    def explore(self, grid, originX, originY, position):
+        blocked = self.costMap(grid, self.inflation)
+        frontier = self.frontier(grid, blocked)
+
+        goal = self.goal
+        if goal is None or self.isBlocked(~frontier, (goal[0] - originX, goal[1] - originY)) or self.octile(goal, position) <= self.lookahead:
+            cells = np.argwhere(frontier)
+            distances = (cells[:, 0] + originX - position[0])**2 + (cells[:, 1] + originY - position[1])**2
+            cells = cells[distances > self.lookahead**2]
+            distances = distances[distances > self.lookahead**2]
+            if len(cells) == 0:
+                self.goal = None
+                self.path = []
+                return self.path
+            nearest = np.argmin(distances)
+            goal = (int(cells[nearest, 0]) + originX, int(cells[nearest, 1]) + originY)
+
+        return self.plan(grid, originX, originY, position, goal, blocked)
+
+    #This method returns a path of world cells from start to goal, both given as world cells
+    #originX, originY is the world cell at position (0, 0) of the window, see ChunkWindow.origin
+    #The previous path is reused if the goal is unchanged and the rest of the path is still clear
+    #returns an empty list if no path exists
+    def plan(self, grid, originX, originY, start, goal, blocked=None):
+        if blocked is None:
+            blocked = self.costMap(grid, self.inflation)
+        startCell = (start[0] - originX, start[1] - originY)
+        goalCell = (goal[0] - originX, goal[1] - originY)
+
+        #if the robot is already within the inflated area around an obstruction plan on the obstructions alone
+        if self.isBlocked(blocked, startCell):
+            blocked = self.costMap(grid, 0)
+
+        if goal == self.goal and self.path:
+            remaining = self.remainingPath(start)
+            if remaining is not None and not self.pathBlocked(blocked, remaining, originX, originY):
+                self.path = remaining
+                return self.path
+
+        self.goal = goal
+        self.replans += 1
+        cells = self.jumpPointSearch(blocked, startCell, goalCell)
+        self.path = [(x + originX, y + originY) for (x, y) in cells]
+        return self.path
+
+    #This method returns the portion of the current path from the cell nearest the robot onwards, or None if the robot has left the path
+    def remainingPath(self, start):
+        cells = np.array(self.path)
+        distances = np.max(np.abs(cells - np.array(start)), axis=1)
+        nearest = int(np.argmin(distances))
+        if distances[nearest] > 1:
+            return None
+        return [start] + self.path[nearest+1:]
+
+    def pathBlocked(self, blocked, path, originX, originY):
+        if len(path) < 2:
+            return False
+        cells = np.array(path[1:]) - np.array([originX, originY])
+        outside = (cells[:, 0] < 0) | (cells[:, 0] >= blocked.shape[0]) | (cells[:, 1] < 0) | (cells[:, 1] >= blocked.shape[1])
+        if np.any(outside):
+            return True
+        return bool(np.any(blocked[cells[:, 0], cells[:, 1]]))
+
+    def isBlocked(self, blocked, cell):
+        if cell[0] < 0 or cell[0] >= blocked.shape[0] or cell[1] < 0 or cell[1] >= blocked.shape[1]:
+            return True
+        return bool(blocked[cell[0], cell[1]])
+
+    #This method runs A* with jump point search between two window cells
+    #diagonal moves are only allowed when both adjacent cells are free, so paths never cut the corner of an obstruction
+    #returns the list of cells along the path, or an empty list if no path exists
+    def jumpPointSearch(self, blocked, start, goal):
+        start = (int(start[0]), int(start[1]))
+        goal = (int(goal[0]), int(goal[1]))
+        if self.isBlocked(blocked, start) or self.isBlocked(blocked, goal):
+            return []
+
+        #the map is padded with a border of blocked cells and flattened so that each lookup is a single index into a bytearray
+        self.width = blocked.shape[1] + 2
+        padded = np.zeros((blocked.shape[0] + 2, blocked.shape[1] + 2), dtype=np.uint8)
+        padded[1:-1, 1:-1] = ~blocked
+        self.free = bytearray(padded.tobytes())
+        self.target = (goal[0] + 1, goal[1] + 1)
+
+        start = (start[0] + 1, start[1] + 1)
+        costs = {start:0}
+        parents = {start:None}
+        openList = [(self.octile(start, self.target), 0, start)]
+        closed = set()
+
+        while openList:
+            estimate, cost, node = heapq.heappop(openList)
+            if node in closed:
+                continue
+            if node == self.target:
+                return self.expandPath(parents, node)
+            closed.add(node)
+
+            for dx, dy in self.prunedDirections(node, parents[node]):
+                jumpPoint = self.jump(node[0] + dx, node[1] + dy, dx, dy)
+                if jumpPoint is None or jumpPoint in closed:
+                    continue
+                nextCost = cost + self.octile(node, jumpPoint)
+                if nextCost < costs.get(jumpPoint, float('inf')):
+                    costs[jumpPoint] = nextCost
+                    parents[jumpPoint] = node
+                    heapq.heappush(openList, (nextCost + self.octile(jumpPoint, self.target), nextCost, jumpPoint))
+
+        return []
+
+    def isFree(self, x, y):
+        return self.free[x*self.width + y] == 1
+
+    #This method returns the directions worth searching from a node, given the node it was reached from
+    def prunedDirections(self, node, parent):
+        x, y = node
+        free = self.isFree
+        if parent is None:
+            directions = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if (dx != 0 or dy != 0)]
+            return [(dx, dy) for (dx, dy) in directions if free(x + dx, y + dy) and (dx == 0 or dy == 0 or (free(x + dx, y) and free(x, y + dy)))]
+
+        dx = (x > parent[0]) - (x < parent[0])
+        dy = (y > parent[1]) - (y < parent[1])
+        directions = []
+        if dx != 0 and dy != 0:
+            if free(x, y + dy):
+                directions.append((0, dy))
+            if free(x + dx, y):
+                directions.append((dx, 0))
+            if free(x, y + dy) and free(x + dx, y):
+                directions.append((dx, dy))
+        elif dx != 0:
+            ahead = free(x + dx, y)
+            up = free(x, y + 1)
+            down = free(x, y - 1)
+            if ahead:
+                directions.append((dx, 0))
+                if up:
+                    directions.append((dx, 1))
+                if down:
+                    directions.append((dx, -1))
+            if up:
+                directions.append((0, 1))
+            if down:
+                directions.append((0, -1))
+        else:
+            ahead = free(x, y + dy)
+            right = free(x + 1, y)
+            left = free(x - 1, y)
+            if ahead:
+                directions.append((0, dy))
+                if right:
+                    directions.append((1, dy))
+                if left:
+                    directions.append((-1, dy))
+            if right:
+                directions.append((1, 0))
+            if left:
+                directions.append((-1, 0))
+        return directions
+
+    #This method moves from (x, y) in direction (dx, dy) until it reaches a jump point, the goal, or an obstruction
+    #returns the jump point, or None if an obstruction is reached first
+    def jump(self, x, y, dx, dy):
+        free = self.isFree
+        while True:
+            if not free(x, y):
+                return None
+            if (x, y) == self.target:
+                return (x, y)
+
+            if dx != 0 and dy != 0:
+                #a diagonal move stops wherever a straight move from it would find a jump point
+                if self.jump(x + dx, y, dx, 0) is not None or self.jump(x, y + dy, 0, dy) is not None:
+                    return (x, y)
+                if not (free(x + dx, y) and free(x, y + dy)):
+                    return None
+            elif dx != 0:
+                if (free(x, y - 1) and not free(x - dx, y - 1)) or (free(x, y + 1) and not free(x - dx, y + 1)):
+                    return (x, y)
+            else:
+                if (free(x - 1, y) and not free(x - 1, y - dy)) or (free(x + 1, y) and not free(x + 1, y - dy)):
+                    return (x, y)
+
+            x += dx
+            y += dy
+
+    #This method fills in the cells between the jump points of a path, and removes the padding offset
+    def expandPath(self, parents, node):
+        jumpPoints = []
+        while node is not None:
+            jumpPoints.append(node)
+            node = parents[node]
+        jumpPoints.reverse()
+
+        path = [(jumpPoints[0][0] - 1, jumpPoints[0][1] - 1)]
+        for a, b in zip(jumpPoints, jumpPoints[1:]):
+            dx = (b[0] > a[0]) - (b[0] < a[0])
+            dy = (b[1] > a[1]) - (b[1] < a[1])
+            x, y = a
+            while (x, y) != b:
+                x += dx
+                y += dy
+                path.append((x - 1, y - 1))
+        return path
+
+    @staticmethod
+    def octile(a, b):
+        dx = abs(a[0] - b[0])
+        dy = abs(a[1] - b[1])
+        return max(dx, dy) + (diagonalCost - 1)*min(dx, dy)
+
+    #This method chooses an action which moves the robot along the current path
+    #orientation is the robot's heading in degrees, and position is its world cell
+    #returns an action in the form used by the arbitrator, [forward, left, right, back, none]
+    def steer(self, orientation, position):
+        action = [0,0,0,0,0]
+        if len(self.path) < 2:
+            action[4] = 1
+            return action
+
+        target = self.path[min(self.lookahead, len(self.path) - 1)]
+        heading = degrees(atan2(target[1] - position[1], target[0] - position[0]))
+
+        #the difference between the desired heading and the current orientation, in (-180, 180]
+        difference = (heading - orientation + 180) % 360 - 180
+        if abs(difference) < 20:
+            action[0] = 1
+        elif difference > 0:
+            action[2] = 1
+        else:
+            action[1] = 1
+        return action
@@ -0,0 +1,102 @@
+"""
+    This class keeps reduced resolution copies of every chunk, so coarse views of the map cost only as much as their output.
+    Each level divides a chunk into square blocks of factor by factor cells, and keeps the maximum and sum of each block.
+    Levels are updated only in the blocks containing changed cells. Like the tiles, the arrays of a level are never modified once returned, updates replace them.
+    Sums are kept in float64, since they are updated by adding the change of each cell and would otherwise gather rounding error for as long as a chunk stays in use.
+    Given a capacity, only the levels of that many chunks are kept, the least recently used are released and rebuilt from the chunk's grid when it is next used.
+"""
+
+import numpy as np
+from collections import OrderedDict
+
+defaultFactors = (2, 4, 10)
+
+class MapPyramid(object):
+
+    def __init__(self, chunkSize, capacity=None, factors=defaultFactors):
+        self.chunkSize = chunkSize
+        self.capacity = capacity
+        self.factors = [factor for factor in factors if chunkSize % factor == 0]
+
+        #for each chunk, from least to most recently used, a dictionary from factor to the block maxima and block sums
+        self.chunks = OrderedDict()
+
+        #chunks which have never been written share a single read only grid at each level
+        self.unknown = {}
+        for factor in self.factors:
+            grid = np.full((chunkSize//factor, chunkSize//factor), 0.5, dtype=np.float32)
+            grid.setflags(write=False)
+            self.unknown[factor] = grid
+
+    #This method returns the number of bytes used by the levels of one chunk
+    @staticmethod
+    def chunkBytes(chunkSize, factors=defaultFactors):
+        return sum((chunkSize//factor)**2*(4 + 8) for factor in factors if chunkSize % factor == 0)
+
+    def __contains__(self, key):
+        return key in self.chunks
+
+    #This method computes every level of a chunk from its full grid
+    def build(self, key, grid):
+        levels = {}
+        for factor in self.factors:
+            blocks = self.blocks(grid, factor)
+            levels[factor] = (blocks.max(axis=(1, 3)).astype(np.float32), blocks.sum(axis=(1, 3), dtype=np.float64))
+        self.store(key, levels)
+
+    #This method records the levels of a chunk, releasing the least recently used chunks if there are more than the capacity
+    def store(self, key, levels):
+        self.chunks[key] = levels
+        self.chunks.move_to_end(key)
+        if self.capacity is not None:
+            while len(self.chunks) > self.capacity:
+                self.chunks.popitem(last=False)
+
+    #This method updates the levels of a chunk after a write, changed is a boolean array of the cells which differ between oldGrid and grid
+    def update(self, key, oldGrid, grid, changed):
+        if key not in self.chunks:
+            self.build(key, grid)
+            return
+
+        rows, cols = np.nonzero(changed)
+        if len(rows) == 0:
+            return
+        #when most of the chunk has changed recomputing it is cheaper
+        if len(rows) > changed.size//4:
+            self.build(key, grid)
+            return
+
+        delta = grid[rows, cols].astype(np.float64) - oldGrid[rows, cols]
+        levels = {}
+        for factor, (maxima, sums) in self.chunks[key].items():
+            blockRows = rows//factor
+            blockCols = cols//factor
+
+            sums = sums.copy()
+            np.add.at(sums, (blockRows, blockCols), delta)
+
+            #the maximum of a block can fall as well as rise, so the changed blocks are recomputed
+            width = self.chunkSize//factor
+            changedBlocks = np.unique(blockRows*width + blockCols)
+            blockRows = changedBlocks//width
+            blockCols = changedBlocks % width
+            maxima = maxima.copy()
+            maxima[blockRows, blockCols] = self.blocks(grid, factor)[blockRows, :, blockCols, :].max(axis=(1, 2))
+            levels[factor] = (maxima, sums)
+        self.store(key, levels)
+
+    #This method returns a chunk at a reduced resolution, or None if the chunk's levels are not held
+    #statistic is either "max" or "mean"
+    def level(self, key, factor, statistic="max"):
+        if key not in self.chunks:
+            return None
+        self.chunks.move_to_end(key)
+        maxima, sums = self.chunks[key][factor]
+        if statistic == "max":
+            return maxima
+        return (sums/(factor*factor)).astype(np.float32)
+
+    #This method views a grid as blocks, indexed by block row, row within the block, block column, column within the block
+    def blocks(self, grid, factor):
+        width = self.chunkSize//factor
+        return grid.reshape(width, factor, width, factor)
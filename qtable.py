@@ -0,0 +1,138 @@
+"""
+    This class holds the expected reward of each action in each state seen by Brain, with the targets the network is trained towards.
+    States are rows of contiguous arrays indexed by the state's id, so rows can be read and updated in bulk and training can use a slice of the table without copying it.
+    The arrays double in size when full so adding a state costs constant time on average. Rows below len(table) are only ever changed by update, so another thread may read a slice while states are added.
+
+    A shared table keeps the targets, inputs, and number of states in shared memory so a training process can read them, see attach.
+    When a shared table grows it moves to a new block of shared memory, and the old block's name is removed so it is freed once every process has released it.
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+class QTable(object):
+
+    #moved, if given, is called with the name of a shared table's block each time the table moves to a new one
+    def __init__(self, actions, inputSize, capacity=1024, shared=False, moved=None):
+        self.actions = actions
+        self.inputSize = inputSize
+        self.shared = shared
+        self.moved = moved
+
+        #the shared memory holding the table, and blocks the table has moved out of which are still in use
+        self.memory = None
+        self.retired = []
+
+        #the expected reward of each action, the normalized rewards used as targets, and the input of the network for each state
+        #inputs are the discretized cells of the state, which are all small whole numbers
+        #the expected rewards are only used by the process which updates the table so they are never shared
+        self.values = np.zeros((capacity, actions))
+        self.allocate(capacity)
+        if self.moved is not None and self.memory is not None:
+            self.moved(self.memory.name)
+
+    #the number of states is kept with the rows so a process reading a shared table sees both
+    @property
+    def count(self):
+        return int(self.header[0])
+
+    def __len__(self):
+        return self.count
+
+    #This method creates the arrays of the table, in a new block of shared memory if the table is shared
+    def allocate(self, capacity):
+        if not self.shared:
+            self.header = np.zeros(1, dtype=np.int64)
+            self.targets = np.zeros((capacity, self.actions))
+            self.inputs = np.zeros((capacity, self.inputSize), dtype=np.uint8)
+            return
+
+        self.memory = shared_memory.SharedMemory(create=True, size=16 + capacity*(self.actions*8 + self.inputSize))
+        np.ndarray((2,), dtype=np.int64, buffer=self.memory.buf)[1] = capacity
+        self.view(self.memory)
+
+    #This method lays out the arrays of a shared table in a block of shared memory
+    #the block starts with the number of states and the capacity, followed by the targets and then the inputs
+    def view(self, memory):
+        self.header = np.ndarray((2,), dtype=np.int64, buffer=memory.buf, offset=0)
+        capacity = int(self.header[1])
+        self.targets = np.ndarray((capacity, self.actions), dtype=np.float64, buffer=memory.buf, offset=16)
+        self.inputs = np.ndarray((capacity, self.inputSize), dtype=np.uint8, buffer=memory.buf, offset=16 + self.targets.nbytes)
+
+    #This method moves a copy of a shared table, such as one in a forked training process, to the block of shared memory the table now uses
+    #raises FileNotFoundError if the table has since moved again
+    def attach(self, name):
+        memory = shared_memory.SharedMemory(name=name)
+        self.view(memory)
+        if self.memory is not None:
+            self.retired.append(self.memory)
+        self.memory = memory
+        self.release()
+
+    #This method adds states to the table, values and inputs have a row for each state
+    #targets are computed from the values unless they are given
+    #returns the ids of the new states
+    def add(self, values, inputs, targets=None):
+        values = np.asarray(values, dtype=np.float64).reshape(-1, self.actions)
+        count = self.count
+        ids = np.arange(count, count + len(values))
+        if count + len(values) > len(self.values):
+            self.grow(count + len(values))
+
+        self.values[ids] = values
+        self.targets[ids] = self.normalize(values) if targets is None else targets
+        self.inputs[ids] = inputs
+
+        #the rows are filled before they are counted, so readers never see a partly added state
+        self.header[0] = count + len(values)
+        return ids
+
+    #This method reallocates the arrays so they hold at least the given number of states
+    def grow(self, capacity):
+        capacity = max(capacity, 2*len(self.values))
+        count = self.count
+
+        values = np.zeros((capacity, self.actions))
+        values[:count] = self.values[:count]
+        self.values = values
+
+        oldMemory, targets, inputs = self.memory, self.targets, self.inputs
+        self.allocate(capacity)
+        self.targets[:count] = targets[:count]
+        self.inputs[:count] = inputs[:count]
+        self.header[0] = count
+        if self.moved is not None and self.memory is not oldMemory:
+            self.moved(self.memory.name)
+
+        if oldMemory is not None:
+            oldMemory.unlink()
+            self.retired.append(oldMemory)
+            del targets, inputs
+            self.release()
+
+    #This method releases the blocks the table has moved out of, blocks still viewed by arrays elsewhere are kept until a later call
+    def release(self):
+        for memory in list(self.retired):
+            try:
+                memory.close()
+                self.retired.remove(memory)
+            except BufferError:
+                pass
+
+    #This method removes the table's shared memory, it is freed once every process has released it
+    def unlink(self):
+        if self.memory is not None:
+            self.memory.unlink()
+
+    #This method sets the expected rewards of many states at once, and recomputes their targets
+    def update(self, ids, values):
+        self.values[ids] = values
+        self.targets[ids] = self.normalize(self.values[ids])
+
+    #This method scales each row of rewards to [0, 1] so they can be used as targets for the network
+    #rows in which every reward is equal become zero
+    @staticmethod
+    def normalize(rewards):
+        worstReward = rewards.min(axis=1, keepdims=True)
+        spread = rewards.max(axis=1, keepdims=True) - worstReward
+        return np.where(spread > 0, (rewards - worstReward)/np.where(spread > 0, spread, 1), 0.0)
@@ -0,0 +1,116 @@
+"""
+    These classes hold the experiences replayed by Brain to propagate rewards backwards through the state table.
+    Experiences are (state id, action, reward, next state id) records kept in a fixed size ring buffer, so adding an experience costs the same however large the buffer is, and the oldest experience is overwritten once it is full.
+    ReplayMemory samples experiences uniformly, PrioritizedReplayMemory samples them in proportion to the size of their last update, and both are used the same way.
+"""
+
+import numpy as np
+
+#the layout of a single experience
+experienceType = np.dtype([('state', np.int32), ('action', np.uint8), ('reward', np.float64), ('nextState', np.int32)])
+
+class ReplayMemory(object):
+
+    def __init__(self, capacity, seed=None):
+        self.capacity = capacity
+        self.memory = np.zeros(capacity, dtype=experienceType)
+
+        #the position the next experience is written to, and the number of experiences held
+        self.next = 0
+        self.count = 0
+
+        self.random = np.random.RandomState(seed)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, state, action, reward, nextState):
+        self.memory[self.next] = (state, action, reward, nextState)
+        self.next = (self.next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    #This method chooses count experiences uniformly at random
+    #returns the positions of the experiences, the experiences as a structured array, and the weight to give each experience's update
+    def sample(self, count):
+        positions = self.random.randint(0, self.count, count)
+        return positions, self.memory[positions], np.ones(count)
+
+    #This method records the errors of the updates made from sampled experiences, uniform sampling has no use for them
+    def update(self, positions, errors):
+        pass
+
+#This class implements a binary tree in which every node holds the sum of its children, stored in an array with the root at index 1
+#leaves are set and sampled in proportion to their values for many positions at once, both in O(log n)
+class SumTree(object):
+
+    def __init__(self, capacity):
+        self.size = 1
+        self.depth = 0
+        while self.size < capacity:
+            self.size *= 2
+            self.depth += 1
+        self.nodes = np.zeros(2*self.size)
+
+    def total(self):
+        return self.nodes[1]
+
+    #This method returns the values of the leaves at the given positions
+    def values(self, positions):
+        return self.nodes[positions + self.size]
+
+    #This method sets the values of the leaves at the given positions
+    #the change in each leaf is added to every node above it at once, if a position is given more than once its last value is used
+    def update(self, positions, values):
+        positions, last = np.unique(positions[::-1], return_index=True)
+        values = values[::-1][last]
+        leaves = positions + self.size
+        changes = values - self.nodes[leaves]
+        ancestors = leaves[:, None] >> np.arange(self.depth + 1)
+        np.add.at(self.nodes, ancestors.ravel(), np.repeat(changes, self.depth + 1))
+
+    #This method finds the leaf within which each target falls, when the leaves are laid end to end
+    #targets must lie in [0, total)
+    def find(self, targets):
+        nodes = np.ones(len(targets), dtype=np.intp)
+        for level in range(self.depth):
+            nodes *= 2
+            left = self.nodes[nodes]
+            right = targets >= left
+            targets = targets - right*left
+            nodes += right
+        return nodes - self.size
+
+#This class samples experiences in proportion to their priority, (|error| + epsilon)^alpha of the experience's last update, kept in a SumTree
+#new experiences are given the highest priority seen so they are replayed at least once
+#the bias of sampling some experiences more often than others is corrected by weighting updates by (count*probability)^-beta, scaled so the largest weight is 1
+class PrioritizedReplayMemory(ReplayMemory):
+
+    def __init__(self, capacity, seed=None, alpha=0.6, beta=0.4, epsilon=0.01):
+        ReplayMemory.__init__(self, capacity, seed)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.tree = SumTree(capacity)
+        self.maxPriority = 1.0
+
+    def add(self, state, action, reward, nextState):
+        position = self.next
+        ReplayMemory.add(self, state, action, reward, nextState)
+        self.tree.update(np.array([position]), np.array([self.maxPriority]))
+
+    #This method chooses count experiences in proportion to their priority, one from each of count equal divisions of the total priority
+    #returns the positions of the experiences, the experiences as a structured array, and the weight to give each experience's update
+    def sample(self, count):
+        total = self.tree.total()
+        targets = (np.arange(count) + self.random.random_sample(count))*(total/count)
+        positions = np.minimum(self.tree.find(np.minimum(targets, np.nextafter(total, 0))), self.count - 1)
+
+        probabilities = self.tree.values(positions)/total
+        weights = (self.count*probabilities)**(-self.beta)
+        return positions, self.memory[positions], weights/weights.max()
+
+    #This method sets the priorities of sampled experiences from the errors of the updates made from them
+    def update(self, positions, errors):
+        priorities = (np.abs(errors) + self.epsilon)**self.alpha
+        self.maxPriority = max(self.maxPriority, float(priorities.max()))
+        self.tree.update(positions, priorities)
@@ -0,0 +1,101 @@
+"""
+    This class publishes the weights of a network trained in another process, through a block of shared memory.
+    The block holds two copies of the weights. A new version is written to the copy not in use, and then the version counter is advanced, so readers use the weights in place while the next version is written.
+    Readers check after use that the writer has not started a second version since, which would have overwritten the copy they read, and retry if it has.
+    The block also carries the training process's status: the error of the published weights, a request to stop, and the name of the shared memory holding the rows of the state table.
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+#the version being written, the version published, the generation of the table's block, and whether the trainer should stop
+headerFields = 4
+
+#the error of the published weights, and the beta of each copy
+statusFields = 3
+
+#room for the name of the table's block
+nameBytes = 64
+
+class SharedWeights(object):
+
+    def __init__(self, shapes):
+        self.shapes = [tuple(shape) for shape in shapes]
+        weightBytes = sum(int(np.prod(shape))*8 for shape in self.shapes)
+
+        self.memory = shared_memory.SharedMemory(create=True, size=headerFields*8 + statusFields*8 + nameBytes + 2*weightBytes)
+        self.header = np.ndarray((headerFields,), dtype=np.int64, buffer=self.memory.buf, offset=0)
+        self.status = np.ndarray((statusFields,), dtype=np.float64, buffer=self.memory.buf, offset=headerFields*8)
+        self.name = np.ndarray((nameBytes,), dtype=np.uint8, buffer=self.memory.buf, offset=headerFields*8 + statusFields*8)
+
+        #the two copies of the weights
+        self.copies = []
+        offset = headerFields*8 + statusFields*8 + nameBytes
+        for copy in range(2):
+            weights = []
+            for shape in self.shapes:
+                weights.append(np.ndarray(shape, dtype=np.float64, buffer=self.memory.buf, offset=offset))
+                offset += weights[-1].nbytes
+            self.copies.append(weights)
+
+        self.status[0] = float('nan')
+
+    #This method publishes a new version of the weights, it must only be called by one process
+    def publish(self, weights, beta, error=float('nan')):
+        version = int(self.header[1]) + 1
+        self.header[0] = version
+        for target, source in zip(self.copies[version % 2], weights):
+            target[...] = source
+        self.status[1 + version % 2] = beta
+        self.status[0] = error
+        self.header[1] = version
+
+    #This method returns the version of the published weights, the weights, and their beta
+    #the weights are views of the shared memory, once used check that they are still valid
+    def current(self):
+        version = int(self.header[1])
+        return version, self.copies[version % 2], float(self.status[1 + version % 2])
+
+    #This method returns whether the weights of the given version have not been overwritten
+    def valid(self, version):
+        return self.header[0] <= version + 1
+
+    #This method returns a copy of the published weights
+    def read(self):
+        while True:
+            version, weights, beta = self.current()
+            weights = [np.copy(w) for w in weights]
+            if self.valid(version):
+                return weights
+
+    #This method returns the error of the published weights, nan until the trainer has published any
+    def error(self):
+        return float(self.status[0])
+
+    #This method records the name of the shared memory holding the state table
+    #the generation of the table is odd while the name is written, and even once it is complete
+    def setTable(self, name):
+        encoded = name.encode()
+        self.header[2] += 1
+        self.name[:] = 0
+        self.name[:len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+        self.header[2] += 1
+
+    #This method returns the generation and name of the shared memory holding the state table
+    #the name is read again if the table is moved while it is read
+    def table(self):
+        while True:
+            generation = int(self.header[2])
+            name = bytes(self.name).rstrip(b"\0").decode()
+            if generation % 2 == 0 and generation == self.header[2]:
+                return generation, name
+
+    def stop(self):
+        self.header[3] = 1
+
+    def stopping(self):
+        return self.header[3] != 0
+
+    #This method removes the shared memory, the memory is freed once every process has released it
+    def unlink(self):
+        self.memory.unlink()
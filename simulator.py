@@ -0,0 +1,119 @@
+"""
+    This class simulates the robot in a two dimensional occupancy world so the system can be run without the Raspberry Pi.
+    It provides step and read methods which behave like those in pi.motor2 and pi.ultratest2, but never sleep.
+    The world is loaded from a .npy file, or an image if Pillow is installed, where values above 0.5 (or dark pixels) are obstructions.
+"""
+
+import numpy as np
+from math import cos
+from math import sin
+from math import pi
+from math import radians
+
+class Simulator(object):
+
+    #these constants match those in pi.motor2
+    forwardStep = (pi*5.04)*(1.0/400)
+    turnStep = (forwardStep/(pi*11.5))*360
+
+    #the servo direction at which the sensor faces straight ahead
+    forwardDirection = 120
+
+    def __init__(self, world, startX=None, startY=None, maxRange=500, noise=0, seed=None):
+        if isinstance(world, str):
+            world = self.loadWorld(world)
+        self.world = np.asarray(world) > 0.5
+
+        #the robot starts in the center of the world unless told otherwise
+        #the simulated odometry is reported relative to the starting position, as it is on the robot
+        if startX is None:
+            startX = self.world.shape[0]/2
+        if startY is None:
+            startY = self.world.shape[1]/2
+        self.startX = startX
+        self.startY = startY
+
+        self.orientation = 0
+        self.xCoord = 0
+        self.yCoord = 0
+
+        self.maxRange = maxRange
+        self.noise = noise
+        self.random = np.random.RandomState(seed)
+
+        self.command = [0x22,0x0a,0x00,0x2c]
+
+    #This method loads a world from disk
+    #image files are converted to greyscale, dark pixels are obstructions
+    @staticmethod
+    def loadWorld(fileName):
+        if fileName.endswith(".npy"):
+            return np.load(fileName)
+
+        try:
+            from PIL import Image
+        except ImportError:
+            raise ImportError("Pillow is required to load image worlds, use a .npy file instead")
+
+        image = np.asarray(Image.open(fileName).convert("L"), dtype=float)/255.0
+        return 1.0 - image
+
+    #This method returns True if the given position relative to the start is obstructed, or outside of the world
+    def obstructed(self, x, y):
+        worldX = int(np.floor(self.startX + x))
+        worldY = int(np.floor(self.startY + y))
+        if worldX < 0 or worldX >= self.world.shape[0] or worldY < 0 or worldY >= self.world.shape[1]:
+            return True
+        return bool(self.world[worldX, worldY])
+
+    #This method moves the simulated robot, see pi.motor2.step
+    #If the robot would move into an obstruction it does not move, so the reported position always matches the true position
+    def step(self, direction, count):
+        if direction == 'l':
+            self.orientation -= (self.turnStep*count)
+            if self.orientation < 0:
+                self.orientation += 360
+        elif direction == 'r':
+            self.orientation += (self.turnStep*count)
+            if self.orientation > 360:
+                self.orientation -= 360
+        elif direction == 'f' or direction == 'b':
+            heading = self.orientation if direction == 'f' else self.orientation + 180
+            newX = self.xCoord + cos(radians(heading))*self.forwardStep*count
+            newY = self.yCoord + sin(radians(heading))*self.forwardStep*count
+            if not self.obstructed(newX, newY):
+                self.xCoord = newX
+                self.yCoord = newY
+        else:
+            return None
+
+        return (self.orientation, self.xCoord, self.yCoord)
+
+    #This method reads the distance to the nearest obstruction, see pi.ultratest2.read
+    #direction is the servo direction in [0,180]
+    def read(self, direction):
+        self.command[1] = int(direction/6)
+        self.command[3] = self.command[0] + self.command[1]
+
+        angle = radians(self.orientation + (self.command[1]*6 - self.forwardDirection))
+        return (self.command[1], self.castRay(angle))
+
+    #This method finds the distance along a ray to the first obstructed cell, or the maximum range
+    def castRay(self, angle):
+        dists = np.arange(0, self.maxRange, 0.5)
+        xs = np.floor(self.startX + self.xCoord + cos(angle)*dists).astype(np.intp)
+        ys = np.floor(self.startY + self.yCoord + sin(angle)*dists).astype(np.intp)
+
+        hits = (xs < 0) | (xs >= self.world.shape[0]) | (ys < 0) | (ys >= self.world.shape[1])
+        inBounds = ~hits
+        hits[inBounds] = self.world[xs[inBounds], ys[inBounds]]
+
+        if np.any(hits):
+            dist = dists[np.argmax(hits)]
+        else:
+            dist = self.maxRange
+
+        if self.noise > 0:
+            dist += self.random.normal(0, self.noise)
+
+        return max(int(round(dist)), 0)
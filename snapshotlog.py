@@ -0,0 +1,107 @@
+"""
+    This class writes snapshots of the map to an append only log so it can be examined while the system continues to explore.
+    Each checkpoint appends only the chunks which have changed since the previous one. A record is a header of the chunk's x, y, and payload size followed by its grid as raw float32 values.
+    The most recent record of each chunk is its current contents. When the log grows to several times the size of the map it is compacted, keeping only the most recent records.
+    Since a grid follows a 12 byte header every grid starts on a multiple of 4 bytes, so a log can be read in place by MapReader while it is still being written.
+"""
+
+import os
+import mmap
+import struct
+import numpy as np
+
+#x, y, and the number of bytes in the grid which follows
+recordHeader = struct.Struct("<iiI")
+
+class SnapshotLog(object):
+
+    def __init__(self, fileName, chunkSize, reset=False, compactionRatio=3):
+        self.fileName = fileName
+        self.chunkSize = chunkSize
+        self.compactionRatio = compactionRatio
+
+        #the offset of the most recent record of each chunk
+        self.latest = {}
+
+        directory = os.path.dirname(fileName)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if reset or not os.path.exists(fileName):
+            open(fileName, 'wb').close()
+        else:
+            self.latest, end = self.scan(fileName)
+            #discard any partially written record at the end of the log
+            with open(fileName, 'r+b') as logFile:
+                logFile.truncate(end)
+
+        self.size = os.path.getsize(fileName)
+
+    #This method appends a checkpoint, chunks is a list of ((x, y), grid) pairs
+    def append(self, chunks):
+        if len(chunks) == 0:
+            return
+        with open(self.fileName, 'ab') as logFile:
+            for key, grid in chunks:
+                payload = np.ascontiguousarray(grid, dtype=np.float32).tobytes()
+                self.latest[key] = self.size
+                logFile.write(recordHeader.pack(key[0], key[1], len(payload)))
+                logFile.write(payload)
+                self.size += recordHeader.size + len(payload)
+            logFile.flush()
+            os.fsync(logFile.fileno())
+
+        if self.size > self.compactionRatio*self.liveSize():
+            self.compact()
+
+    #This method returns the size of the log if it held only the most recent record of each chunk
+    def liveSize(self):
+        return len(self.latest)*(recordHeader.size + self.chunkSize*self.chunkSize*4)
+
+    #This method rewrites the log keeping only the most recent record of each chunk
+    #the new log replaces the old one atomically, so a reader always sees a complete log
+    def compact(self):
+        temporary = self.fileName + ".tmp"
+        latest = {}
+        offset = 0
+        with open(self.fileName, 'rb') as oldLog, open(temporary, 'wb') as newLog:
+            for key, start in sorted(self.latest.items(), key=lambda item: item[1]):
+                oldLog.seek(start)
+                header = oldLog.read(recordHeader.size)
+                length = recordHeader.unpack(header)[2]
+                newLog.write(header)
+                newLog.write(oldLog.read(length))
+                latest[key] = offset
+                offset += recordHeader.size + length
+            newLog.flush()
+            os.fsync(newLog.fileno())
+        os.replace(temporary, self.fileName)
+        self.latest = latest
+        self.size = offset
+
+    #This method finds the most recent record of each chunk in a log
+    #returns the offsets of the records, and the end of the last complete record
+    @staticmethod
+    def scan(fileName):
+        if os.path.getsize(fileName) == 0:
+            return {}, 0
+        with open(fileName, 'rb') as logFile:
+            data = mmap.mmap(logFile.fileno(), 0, access=mmap.ACCESS_READ)
+        latest, end = SnapshotLog.records(data)
+        data.close()
+        return latest, end
+
+    #This method finds the most recent record of each chunk in the contents of a log
+    #returns the offsets of the records, and the end of the last complete record
+    @staticmethod
+    def records(data):
+        latest = {}
+        offset = 0
+        size = len(data)
+        while offset + recordHeader.size <= size:
+            x, y, length = recordHeader.unpack_from(data, offset)
+            if offset + recordHeader.size + length > size:
+                break
+            latest[(x, y)] = offset
+            offset += recordHeader.size + length
+        return latest, offset
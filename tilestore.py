@@ -0,0 +1,178 @@
+"""
+    This class stores the grids of map chunks as fixed size tiles.
+    When given a directory the tiles are kept in a memory mapped file, tiles.dat, with an index from chunk coordinates to tile slot in index.npy.
+    Only a limited number of tiles are held in memory at once, the least recently used tiles are written back to the file and released when the memory budget is exceeded.
+    Without a directory every tile is kept in memory.
+
+    Tiles are copy on write, a grid returned by get is never modified, put stores a new grid and increments the tile's version.
+    This allows a snapshot of the modified tiles to be written to the file by another thread while the store continues to be used.
+    Access to the file is guarded by its own lock, held for one tile at a time, and a tile is only written if it is newer than the version already in the file.
+"""
+
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+
+class TileStore(object):
+
+    def __init__(self, chunkSize, directory=None, memoryBudget=64*2**20):
+        self.chunkSize = chunkSize
+        self.directory = directory
+        self.tileBytes = chunkSize*chunkSize*4
+
+        #the tiles currently held in memory, from least to most recently used, and those which are newer than the version in the file
+        self.resident = OrderedDict()
+        self.dirty = set()
+
+        #the version of each tile, and the version of each tile in the file
+        self.version = {}
+        self.fileVersion = {}
+
+        #the slot of each tile in the file
+        self.index = {}
+        self.tiles = None
+        self.fileLock = threading.Lock()
+
+        if directory is None:
+            self.capacity = None
+            return
+
+        #at least a full window of tiles must fit in memory
+        self.capacity = max(memoryBudget//self.tileBytes, 9)
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        #reopen an existing map, only the index is read, tiles are paged in from the file as they are used
+        if os.path.exists(self.indexFile()):
+            for x, y, slot in np.load(self.indexFile()):
+                self.index[(int(x), int(y))] = int(slot)
+        if os.path.exists(self.tileFile()):
+            slots = os.path.getsize(self.tileFile())//self.tileBytes
+            self.tiles = np.memmap(self.tileFile(), dtype=np.float32, mode='r+', shape=(slots, chunkSize, chunkSize))
+
+    def tileFile(self):
+        return os.path.join(self.directory, "tiles.dat")
+
+    def indexFile(self):
+        return os.path.join(self.directory, "index.npy")
+
+    def __contains__(self, key):
+        return key in self.index or key in self.resident
+
+    def __len__(self):
+        return len(self.keys())
+
+    #This method returns the coordinates of every stored tile
+    def keys(self):
+        with self.fileLock:
+            return set(self.index.keys()) | set(self.resident.keys())
+
+    #This method returns the grid of a tile, or None if it has never been stored
+    #the grid must not be modified, use put to store a new grid
+    def get(self, x, y):
+        key = (x, y)
+        if key in self.resident:
+            self.resident.move_to_end(key)
+            return self.resident[key]
+        if key not in self.index:
+            return None
+
+        with self.fileLock:
+            grid = np.array(self.tiles[self.index[key]])
+        self.resident[key] = grid
+        self.evict()
+        return grid
+
+    #This method returns the grid of a tile without making it resident, or None if it has never been stored
+    #used to read every tile once, such as when exporting the map, without releasing the tiles in use
+    def read(self, x, y):
+        key = (x, y)
+        if key in self.resident:
+            return self.resident[key]
+        if key not in self.index:
+            return None
+        with self.fileLock:
+            return np.array(self.tiles[self.index[key]])
+
+    #This method stores a new grid for a tile
+    def put(self, x, y, grid):
+        key = (x, y)
+        if key in self.resident:
+            self.resident.move_to_end(key)
+        self.resident[key] = np.array(grid, dtype=np.float32)
+        self.version[key] = self.version.get(key, 0) + 1
+        self.dirty.add(key)
+        self.evict()
+
+    #This method releases the least recently used tiles until the memory budget is met
+    def evict(self):
+        if self.capacity is None:
+            return
+        while len(self.resident) > self.capacity:
+            key, grid = self.resident.popitem(last=False)
+            if key in self.dirty:
+                self.writeTile(key, grid, self.version[key])
+                self.dirty.discard(key)
+
+    #This method writes a tile to its slot in the file, allocating a slot for new tiles
+    #nothing is written if the file already holds this version of the tile or a newer one
+    def writeTile(self, key, grid, version):
+        with self.fileLock:
+            if self.fileVersion.get(key, 0) >= version:
+                return
+            if key not in self.index:
+                slot = len(self.index)
+                if self.tiles is None or slot >= len(self.tiles):
+                    self.grow(slot + 1)
+                self.index[key] = slot
+            self.tiles[self.index[key]] = grid
+            self.fileVersion[key] = version
+
+    #This method extends the file so it holds at least the given number of slots
+    #the file is doubled in size so it is rarely extended
+    def grow(self, slots):
+        current = 0 if self.tiles is None else len(self.tiles)
+        newSlots = max(slots, current*2, 16)
+        if self.tiles is not None:
+            self.tiles.flush()
+            self.tiles = None
+        with open(self.tileFile(), 'ab') as tileFile:
+            tileFile.truncate(newSlots*self.tileBytes)
+        self.tiles = np.memmap(self.tileFile(), dtype=np.float32, mode='r+', shape=(newSlots, self.chunkSize, self.chunkSize))
+
+    #This method returns the modified tiles as a list of (key, version, grid), it is cheap since grids are never modified in place
+    def snapshot(self):
+        if self.directory is None:
+            return []
+        return [(key, self.version[key], self.resident[key]) for key in self.dirty]
+
+    #This method writes a snapshot to disk, it may be called from another thread while the store is in use
+    def writeSnapshot(self, tiles):
+        if self.directory is None:
+            return
+        for key, version, grid in tiles:
+            self.writeTile(key, grid, version)
+
+        with self.fileLock:
+            if self.tiles is not None:
+                self.tiles.flush()
+            index = np.array([(key[0], key[1], slot) for key, slot in self.index.items()], dtype=np.int64).reshape(-1, 3)
+
+        #the index is replaced atomically so a crash never leaves it pointing at missing slots
+        temporary = self.indexFile() + ".tmp.npy"
+        np.save(temporary, index)
+        os.replace(temporary, self.indexFile())
+
+    #This method marks the tiles of a written snapshot as clean, unless they have been modified since
+    def markWritten(self, tiles):
+        for key, version, grid in tiles:
+            if self.version[key] == version:
+                self.dirty.discard(key)
+
+    #This method writes every modified tile, and the index, to disk
+    def flush(self):
+        tiles = self.snapshot()
+        self.writeSnapshot(tiles)
+        self.markWritten(tiles)